@@ -0,0 +1,257 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Compares the slotted plugin model and its schema-driven load and save
+against the former representation, instance dictionaries discovered with
+dir() on every load, on a synthetic catalog held in memory.
+
+    python bench/bench_model.py [--plugins 10000] [--versions 3]
+"""
+import argparse
+import bisect
+import gc
+import re
+import sys
+import time
+import tracemalloc
+from configparser import ConfigParser
+from enum import Enum
+from functools import wraps
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+
+from blackdog import config
+from blackdog.plugin import Plugin, PluginStage, PluginVersion, version_key
+
+
+def legacy_config_node(node, type=str, section=None):
+    def decorator(fun):
+        config_field = '__config__' + re.sub(r'[^a-zA-Z0-9_]', '_', node)
+
+        @wraps(fun)
+        def wrapper(self, *args, **kwargs):
+            if len(args) == 1:
+                setattr(self, config_field, args[0])
+            elif 'value' in kwargs:
+                setattr(self, config_field, kwargs['value'])
+            else:
+                if not hasattr(self, config_field) or 'default' in kwargs and kwargs['default']:
+                    return fun(self)
+                return getattr(self, config_field)
+
+        wrapper.config_node = node
+        wrapper.config_type = type
+        wrapper.config_section = section
+        return wrapper
+    return decorator
+
+
+def legacy_load(config: ConfigParser, obj, section):
+    attrs = [(f, getattr(obj, f)) for f in dir(obj)]
+    for name, method in [(n, m) for (n, m) in attrs if callable(m) and hasattr(m, 'config_node')]:
+        real_section = method.config_section if method.config_section else section
+        val = config.get(real_section, method.config_node, fallback=None)
+
+        if val:
+            if method.config_type == list:
+                val = [e.strip() for e in val.split(',')]
+            elif method.config_type == bool:
+                try:
+                    val = config.getboolean(real_section, method.config_node, fallback=None)
+                except ValueError:
+                    val = None
+            elif issubclass(method.config_type, Enum):
+                val = method.config_type.from_string(val)
+            method(val)
+        else:
+            method(method(default=True))
+
+
+def legacy_save(config: ConfigParser, obj, section):
+    attrs = [(f, getattr(obj, f)) for f in dir(obj)]
+    for name, method in [(n, m) for (n, m) in attrs if callable(m) and hasattr(m, 'config_node')]:
+        real_section = method.config_section if method.config_section else section
+        val = method()
+
+        if val:
+            if method.config_type == list:
+                val = ', '.join(val)
+            elif isinstance(val, Enum):
+                val = val.name
+            else:
+                val = str(val)
+
+            if not config.has_section(real_section):
+                config.add_section(real_section)
+            config.set(real_section, method.config_node, val)
+
+
+class LegacyPlugin(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.path_name = re.sub(r'[^a-zA-Z0-9_\-]', '_', name)
+        self.versions = {}
+        self.__index = []
+        self.__metadata = {}
+
+    @legacy_config_node('summary')
+    def summary(self):
+        return None
+
+    @legacy_config_node('display-name')
+    def display_name(self):
+        return self.name
+
+    @legacy_config_node('stage')
+    def stage(self):
+        return None
+
+    @legacy_config_node('exists', type=bool)
+    def exists(self):
+        return None
+
+    def add_version(self, version):
+        vstr = version.version()
+        if vstr not in self.versions:
+            bisect.insort(self.__index, (version_key(vstr), vstr))
+        self.versions[vstr] = version
+        self.__metadata.clear()
+
+
+class LegacyPluginVersion(object):
+
+    def __init__(self, plugin, version):
+        self.__plugin = plugin
+        self.__version = version
+
+    def version(self):
+        return self.__version
+
+    @legacy_config_node('url')
+    def url(self):
+        return None
+
+    @legacy_config_node('sha1')
+    def sha1(self):
+        return None
+
+    @legacy_config_node('md5')
+    def md5(self):
+        return None
+
+    @legacy_config_node('date')
+    def date(self):
+        return None
+
+    @legacy_config_node('stage', type=PluginStage)
+    def stage(self):
+        return None
+
+    @legacy_config_node('game-versions', type=list)
+    def game_versions(self):
+        return []
+
+
+def catalog(plugins, versions):
+    """
+    :return: the metadata of every plugin, as read from the storage
+    """
+    configs = []
+    for i in range(plugins):
+        c = ConfigParser()
+        c['plugin'] = {'summary': 'Synthetic plugin number %s.' % i, 'display-name': 'Plugin %s' % i,
+                       'stage': 'release', 'exists': 'true'}
+        c['versions'] = {}
+        for v in range(versions):
+            c['version:1.%s.0' % v] = {'url': 'http://localhost/media/files/plugin%05d/1.%s.0.jar' % (i, v),
+                                       'md5': '%032x' % (i * versions + v), 'date': 'Mar 03, 2014',
+                                       'stage': 'release', 'game-versions': 'CB 1.7.2-R0.3, CB 1.7.2-R0.2'}
+        configs.append(('plugin%05d' % i, c))
+    return configs
+
+
+def load_all(configs, plugin_cls, version_cls, load):
+    plugins = []
+    for name, c in configs:
+        plugin = plugin_cls(name)
+        load(c, plugin, 'plugin')
+        for section in c.sections():
+            if section.startswith('version:'):
+                version = version_cls(plugin, section[len('version:'):])
+                load(c, version, section)
+                plugin.add_version(version)
+        plugins.append(plugin)
+    return plugins
+
+
+def save_all(plugins, save):
+    for plugin in plugins:
+        c = ConfigParser()
+        save(c, plugin, 'plugin')
+        for vstr, version in plugin.versions.items():
+            save(c, version, 'version:' + vstr)
+
+
+def measure(configs, plugin_cls, version_cls, load, save):
+    gc.collect()
+    start = time.perf_counter()
+    plugins = load_all(configs, plugin_cls, version_cls, load)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    save_all(plugins, save)
+    save_time = time.perf_counter() - start
+
+    # traced separately, tracing slows the loading down
+    del plugins
+    gc.collect()
+    tracemalloc.start()
+    plugins = load_all(configs, plugin_cls, version_cls, load)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return load_time, save_time, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plugin model load, save and memory, slotted against legacy')
+    parser.add_argument('--plugins', type=int, default=10000)
+    parser.add_argument('--versions', type=int, default=3)
+    args = parser.parse_args()
+
+    configs = catalog(args.plugins, args.versions)
+    old = load_all(configs[:1], LegacyPlugin, LegacyPluginVersion, legacy_load)[0]
+    new = load_all(configs[:1], Plugin, PluginVersion, config.load)[0]
+    for f in ['summary', 'display_name', 'stage', 'exists']:
+        assert getattr(old, f)() == getattr(new, f)(), 'plugin %s differs' % f
+    for vstr in old.versions:
+        for f in ['url', 'sha1', 'md5', 'date', 'stage', 'game_versions']:
+            assert getattr(old.versions[vstr], f)() == getattr(new.versions[vstr], f)(), 'version %s differs' % f
+
+    print('%s plugins, %s versions each' % (args.plugins, args.versions))
+    print('{0:>8} {1:>10} {2:>10} {3:>12}'.format('model', 'load s', 'save s', 'memory MiB'))
+    for label, plugin_cls, version_cls, load, save in [
+            ('legacy', LegacyPlugin, LegacyPluginVersion, legacy_load, legacy_save),
+            ('slots', Plugin, PluginVersion, config.load, config.save)]:
+        load_time, save_time, memory = measure(configs, plugin_cls, version_cls, load, save)
+        print('{0:>8} {1:>10.2f} {2:>10.2f} {3:>12.1f}'.format(label, load_time, save_time, memory / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Compares the XPath extraction of the BukkitDev pages against the former
+PyQuery selectors, on the saved plugin listing, files and file pages.
+Both must extract the same data. Requires pyquery for the former parsers.
+
+    python bench/bench_parse.py [--repeat 500]
+"""
+import argparse
+import re
+import sys
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+
+from pyquery import PyQuery
+
+from blackdog import extract
+from blackdog.bukkitdev import BukkitDev
+from blackdog.plugin import Plugin, PluginStage, PluginVersion
+
+FIXTURES = join(dirname(abspath(__file__)), 'fixtures')
+
+
+def pyquery_version_meta(version, text):
+    d = PyQuery(text)
+    path = '#bd section.main .main-body .main-body-inner .line .lastUnit .content-box .content-box-inner dl'
+    info = d(path).children()
+    meta = dict([(PyQuery(dt).text(), PyQuery(dd)) for dt, dd in zip(info[::2], info[1::2])])
+
+    version.md5(meta['MD5'].text())
+    version.stage(PluginStage.from_string(meta['Type'].text()))
+    version.date(meta['Uploaded on'].text())
+    version.game_versions([v.text() for v in meta['Game version']('ul li').items()])
+    version.url(meta['Filename']('a').eq(0).attr('href'))
+
+
+def pyquery_files(text):
+    d = PyQuery(text)
+    files = []
+    for tr in [tr for tr in d('table.listing tbody tr').items()
+               if tr('td.col-filename').text().endswith('.jar')]:
+        version_str = re.sub(r'.*?([0-9]+(\.[0-9]+)+).*', '\\1', tr('td.col-file').text())
+        files.append((version_str, tr('td.col-file a').attr('href')))
+    return files
+
+
+def pyquery_search(text):
+    page_content = PyQuery(text)
+    results = []
+    plugin_table = page_content('#bd .line .unit .listing-container .listing-container-inner table tbody tr')
+
+    for (info, summary) in zip(plugin_table[::2], plugin_table[1::2]):
+        info = PyQuery(info)
+        plugin = Plugin(name=info('td.col-project h2 a').attr('href').split('/')[2])
+        plugin.display_name(re.sub('</?mark>', '', info('td.col-project h2 a').html()))
+        plugin.stage(PluginStage.from_string(info('td.col-status').text()))
+        plugin.summary(re.sub('</?mark>', '', PyQuery(summary)('td.summary').html()))
+        results.append(plugin)
+    return results
+
+
+def xpath_version_meta(version, text):
+    BukkitDev._parse_version_meta(version, extract.parse(text))
+
+
+def xpath_files(text):
+    return BukkitDev._parse_files(extract.parse(text))
+
+
+def xpath_search(text):
+    bukkitdev = BukkitDev.__new__(BukkitDev)
+    bukkitdev.base = ''
+    bukkitdev._query = lambda url, plugin=None: extract.parse(text)
+    return bukkitdev.search()
+
+
+def version_fields(version):
+    return version.md5(), version.stage(), version.date(), version.game_versions(), version.url()
+
+
+def plugin_fields(plugins):
+    return [(p.name, p.display_name(), p.stage(), p.summary()) for p in plugins]
+
+
+def timed(fun, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fun(text)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BukkitDev page extraction, XPath against PyQuery')
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    pages = {}
+    for name in ['listing', 'files', 'file']:
+        with open(join(FIXTURES, name + '.html')) as f:
+            pages[name] = f.read()
+
+    old, new = PluginVersion(Plugin('bench'), '1.0'), PluginVersion(Plugin('bench'), '1.0')
+    pyquery_version_meta(old, pages['file'])
+    xpath_version_meta(new, pages['file'])
+    assert version_fields(old) == version_fields(new), 'file page extraction differs'
+    assert pyquery_files(pages['files']) == xpath_files(pages['files']), 'files page extraction differs'
+    assert plugin_fields(pyquery_search(pages['listing'])) == plugin_fields(xpath_search(pages['listing'])), \
+        'listing page extraction differs'
+
+    cases = [
+        ('listing', pyquery_search, xpath_search),
+        ('files', pyquery_files, xpath_files),
+        ('file', lambda t: pyquery_version_meta(PluginVersion(Plugin('bench'), '1.0'), t),
+                 lambda t: xpath_version_meta(PluginVersion(Plugin('bench'), '1.0'), t)),
+    ]
+
+    print('{0:>8} {1:>14} {2:>14} {3:>8}'.format('page', 'pyquery ms', 'xpath ms', 'speedup'))
+    for name, old_fun, new_fun in cases:
+        old_ms = timed(old_fun, pages[name], args.repeat)
+        new_ms = timed(new_fun, pages[name], args.repeat)
+        print('{0:>8} {1:>14.3f} {2:>14.3f} {3:>7.2f}x'.format(name, old_ms, new_ms, old_ms / new_ms))
+
+
+if __name__ == '__main__':
+    main()
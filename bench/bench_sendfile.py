@@ -0,0 +1,120 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Compares the throughput of jars served with sendfile against the former
+16 KiB read/write loop, for jars of 1 to 50 MB already in the artifact store.
+
+    python bench/bench_sendfile.py [--sizes 1,5,10,25,50] [--repeat 5]
+"""
+import argparse
+import hashlib
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['HOME'] = tempfile.mkdtemp(prefix='blackdog-bench-')
+
+from blackdog import BlackDog, ThreadPoolHTTPServer, Plugin, PluginVersion
+from blackdog.server import RequestHandler
+
+
+class SendfileRequestHandler(RequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ChunkedRequestHandler(SendfileRequestHandler):
+
+    def copy_file(self, path, offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                chunk = f.read(min(16 * 1024, length))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+
+def add_jar(bd, name, size):
+    data = os.urandom(size)
+    md5 = hashlib.md5(data).hexdigest()
+    fd, tmp = tempfile.mkstemp(dir=bd.directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    bd.store.put(md5, tmp)
+
+    plugin = Plugin(name)
+    version = PluginVersion(plugin, '1.0')
+    version.url('http://localhost/%s.jar' % name)
+    version.md5(md5)
+    plugin.add_version(version)
+    bd.bukkitdev.save_plugin(plugin)
+    return '/bench/%s/1.0/%s-1.0.jar' % (name, name)
+
+
+def download(port, path):
+    conn = http.client.HTTPConnection('localhost', port)
+    conn.request('GET', path)
+    r = conn.getresponse()
+    size = 0
+    for chunk in iter(lambda: r.read(256 * 1024), b''):
+        size += len(chunk)
+    conn.close()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Jar serving throughput, sendfile against a chunked loop')
+    parser.add_argument('--sizes', default='1,5,10,25,50', help='jar sizes, in MB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bd = BlackDog()
+    bd.store.set_max_size(1 << 40)
+    sizes = [int(s) for s in args.sizes.split(',')]
+    paths = dict((mb, add_jar(bd, 'bench%s' % mb, mb * 1000 * 1000)) for mb in sizes)
+
+    server = ThreadPoolHTTPServer(0, threads=4)
+    with server:
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print('{0:>8} {1:>14} {2:>14} {3:>8}'.format('size', 'chunked MB/s', 'sendfile MB/s', 'speedup'))
+        for mb in sizes:
+            results = {}
+            for name, handler in [('chunked', ChunkedRequestHandler), ('sendfile', SendfileRequestHandler)]:
+                server.RequestHandlerClass = handler
+                download(port, paths[mb])
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    download(port, paths[mb])
+                results[name] = mb * args.repeat / (time.perf_counter() - start)
+
+            print('{0:>6}MB {1:>14.1f} {2:>14.1f} {3:>7.2f}x'.format(
+                mb, results['chunked'], results['sendfile'], results['sendfile'] / results['chunked']))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
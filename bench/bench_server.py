@@ -0,0 +1,203 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+End-to-end benchmarks against a local stand-in for dev.bukkit.org:
+
+  * cold and warm .pom and .jar latency, the cold requests resolving
+    the plugin upstream and downloading its jar,
+  * throughput of N concurrent Maven clients on warm artifacts,
+  * duration of a full scan of the synthetic catalog.
+
+    python bench/bench_server.py [--plugins 2000] [--latency 0.02] [--clients 16] [--threads 0]
+"""
+import argparse
+import http.client
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+os.environ['HOME'] = tempfile.mkdtemp(prefix='blackdog-bench-')
+
+from fakebukkit import Catalog, FakeBukkitDev
+from blackdog import BlackDog, HTTPServer, ThreadPoolHTTPServer, PluginStage
+from blackdog.server import RequestHandler
+
+
+class QuietRequestHandler(RequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Client(object):
+    """
+    Maven-like client, reusing its connection when the server keeps it alive
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def get(self, path):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('localhost', self.port)
+            try:
+                self.conn.request('GET', path)
+                r = self.conn.getresponse()
+                body = r.read()
+                if r.will_close:
+                    self.close()
+                return r.status, body
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+def artifact_path(name, version, ext):
+    return '/bench/%s/%s/%s-%s.%s' % (name, version, name, version, ext)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return pick(0.5), pick(0.9), pick(0.99)
+
+
+def report(label, samples):
+    p50, p90, p99 = percentiles(samples)
+    print('{0:<12} {1:>6} {2:>10.2f} {3:>10.2f} {4:>10.2f}'.format(label, len(samples), p50, p90, p99))
+
+
+def bench_latency(port, catalog, count):
+    names = [catalog.name(i) for i in random.sample(range(catalog.plugins), count)]
+    version = catalog.version_names()[-1]
+    client = Client(port)
+
+    print('{0:<12} {1:>6} {2:>10} {3:>10} {4:>10}'.format('request', 'count', 'p50 ms', 'p90 ms', 'p99 ms'))
+    for ext in ['pom', 'jar']:
+        for label in ['cold', 'warm']:
+            samples = []
+            for name in names:
+                start = time.perf_counter()
+                status, body = client.get(artifact_path(name, version, ext))
+                samples.append(time.perf_counter() - start)
+                if status != 200:
+                    raise RuntimeError('%s %s answered %s' % (ext, name, status))
+            report('%s %s' % (label, ext), samples)
+    client.close()
+    return names, version
+
+
+def bench_throughput(port, names, version, clients, duration):
+    paths = [artifact_path(n, version, ext) for n in names for ext in ['pom', 'jar', 'jar.sha1', 'pom.md5']]
+    stop = time.monotonic() + duration
+    counts = [0] * clients
+    errors = [0] * clients
+
+    def run(i):
+        client = Client(port)
+        rng = random.Random(i)
+        while time.monotonic() < stop:
+            try:
+                status, body = client.get(rng.choice(paths))
+                counts[i] += 1
+                if status != 200:
+                    errors[i] += 1
+            except Exception:
+                errors[i] += 1
+        client.close()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print('%s clients: %s requests in %.1fs, %.0f req/s, %s errors'
+          % (clients, sum(counts), elapsed, sum(counts) / elapsed, sum(errors)))
+
+
+def bench_scan(bd, upstream, jobs):
+    bd.bukkitdev.plugins.clear()
+    before = upstream.requests
+    start = time.perf_counter()
+    bd.bukkitdev.scan([PluginStage.release, PluginStage.mature], jobs=jobs)
+    elapsed = time.perf_counter() - start
+    plugins = len(bd.bukkitdev.storage.names())
+    print('scan: %s plugins, %s upstream requests in %.1fs, %.1f plugins/s'
+          % (plugins, upstream.requests - before, elapsed, plugins / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BlackDog end-to-end benchmarks against a fake BukkitDev')
+    parser.add_argument('--plugins', type=int, default=2000, help='size of the synthetic catalog')
+    parser.add_argument('--versions', type=int, default=3, help='versions per plugin')
+    parser.add_argument('--jar-size', type=int, default=256 * 1024, help='size of the synthetic jars, in bytes')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every upstream response, in seconds')
+    parser.add_argument('--samples', type=int, default=50, help='plugins requested for the latency measures')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients for the throughput measure')
+    parser.add_argument('--duration', type=float, default=10, help='duration of the throughput measure, in seconds')
+    parser.add_argument('--threads', type=int, default=0, help='server worker threads, 0 for the plain HTTPServer')
+    parser.add_argument('--jobs', type=int, default=8, help='concurrent plugins during the scan')
+    parser.add_argument('--skip-scan', action='store_true')
+    args = parser.parse_args()
+
+    random.seed(0)
+    catalog = Catalog(args.plugins, args.versions, args.jar_size)
+    upstream = FakeBukkitDev(catalog, latency=args.latency).start()
+
+    bd = BlackDog()
+    logging.getLogger().setLevel('WARNING')
+    bd.bukkitdev.base = upstream.base
+    bd.upstream.set_pool_size(max(args.threads, args.jobs, 10))
+
+    if args.threads > 0:
+        server = ThreadPoolHTTPServer(0, threads=args.threads, backlog=1024)
+    else:
+        server = HTTPServer(0, backlog=1024)
+    server.RequestHandlerClass = QuietRequestHandler
+
+    print('fake BukkitDev at %s, %s plugins, %.0f ms latency' % (upstream.base, args.plugins, args.latency * 1000))
+    with server:
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        names, version = bench_latency(port, catalog, min(args.samples, args.plugins))
+        bench_throughput(port, names, version, args.clients, args.duration)
+        server.shutdown()
+
+    if not args.skip_scan:
+        bench_scan(bd, upstream, args.jobs)
+
+
+if __name__ == '__main__':
+    main()
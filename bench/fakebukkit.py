@@ -0,0 +1,250 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Local stand-in for dev.bukkit.org, serving a synthetic catalog of plugins
+with the markup of the pages in bench/fixtures, and synthetic jars.
+Every response is delayed by the configured latency.
+
+    python bench/fakebukkit.py [--port 8150] [--plugins 2000] [--latency 0.05]
+"""
+import argparse
+import hashlib
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STAGES = [('r', 'Release'), ('m', 'Mature')]
+
+PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>%s - Bukkit</title></head>
+<body class="bukkit">
+<div id="bd">
+%s
+</div>
+</body>
+</html>
+'''
+
+LISTING = '''<div class="line"><div class="unit size1of1">
+<div class="listing-container"><div class="listing-container-inner">
+<table class="listing listing-project">
+<thead><tr><th>Project</th><th>Stage</th><th>Authors</th><th>Updated</th></tr></thead>
+<tbody>
+%s
+</tbody>
+</table>
+</div></div>
+</div></div>'''
+
+LISTING_ROW = '''<tr class="even">
+<td class="col-project"><h2><a href="/bukkit-plugins/%(name)s/">Plugin %(index)s</a></h2></td>
+<td class="col-status">%(stage)s</td>
+<td class="col-users"><a href="/profiles/author/">author</a></td>
+<td class="col-date"><abbr class="tip standard-date" data-epoch="1393804800">Mar 03, 2014</abbr></td>
+</tr>
+<tr class="even">
+<td class="summary" colspan="4">Synthetic plugin number %(index)s.</td>
+</tr>'''
+
+FILES = '''<section class="main"><div class="main-body"><div class="main-body-inner">
+<div class="line"><div class="unit size1of1">
+<div class="listing-container"><div class="listing-container-inner">
+<table class="listing listing-file">
+<thead><tr><th>Name</th><th>Type</th><th>Date</th><th>Game version</th><th>Filename</th></tr></thead>
+<tbody>
+%s
+</tbody>
+</table>
+</div></div>
+</div></div>
+</div></div></section>'''
+
+FILES_ROW = '''<tr class="even">
+<td class="col-file"><a href="/bukkit-plugins/%(name)s/files/%(id)s-%(name)s-v%(version)s/">%(name)s v%(version)s</a></td>
+<td class="col-type"><span class="file-type file-type-r">Release</span></td>
+<td class="col-date"><abbr class="tip standard-date" data-epoch="1393804800">Mar 03, 2014</abbr></td>
+<td class="col-game-version"><ul class="comma-separated-list"><li>CB 1.7.2-R0.3</li></ul></td>
+<td class="col-filename">%(name)s-%(version)s.jar</td>
+</tr>'''
+
+FILE = '''<section class="main"><div class="main-body"><div class="main-body-inner">
+<div class="line">
+<div class="lastUnit"><div class="content-box"><div class="content-box-inner">
+<dl>
+<dt>Filename</dt>
+<dd><a href="%(base)s/media/files/%(name)s/%(version)s.jar">%(name)s-%(version)s.jar</a></dd>
+<dt>Uploaded on</dt>
+<dd><abbr class="tip standard-datetime" data-epoch="1393815600">Mar 03, 2014 at 03:00 UTC</abbr></dd>
+<dt>Type</dt>
+<dd><span class="file-type file-type-r">Release</span></dd>
+<dt>Game version</dt>
+<dd><ul class="comma-separated-list"><li>CB 1.7.2-R0.3</li><li>CB 1.7.2-R0.2</li></ul></dd>
+<dt>MD5</dt>
+<dd>%(md5)s</dd>
+</dl>
+</div></div></div>
+</div>
+</div></div></section>'''
+
+
+class Catalog(object):
+    """
+    Synthetic catalog of plugins named plugin00000, plugin00001...
+    alternately released and mature, each with the same number of versions.
+    """
+
+    def __init__(self, plugins=2000, versions=3, jar_size=64 * 1024, per_page=20):
+        self.plugins = plugins
+        self.versions = versions
+        self.jar_size = jar_size
+        self.per_page = per_page
+
+    @staticmethod
+    def name(index):
+        return 'plugin%05d' % index
+
+    @staticmethod
+    def index(name):
+        return int(name[len('plugin'):]) if name.startswith('plugin') and name[len('plugin'):].isdigit() else -1
+
+    def has_plugin(self, name):
+        return 0 <= self.index(name) < self.plugins
+
+    def stage(self, index):
+        return STAGES[index % len(STAGES)]
+
+    def version_names(self):
+        """
+        :return: the versions of every plugin, newest first
+        """
+        return ['1.%s.0' % i for i in reversed(range(self.versions))]
+
+    @lru_cache(maxsize=None)
+    def jar(self, name, version):
+        seed = hashlib.sha256(('%s-%s' % (name, version)).encode()).digest()
+        return (seed * (self.jar_size // len(seed) + 1))[:self.jar_size]
+
+    @lru_cache(maxsize=None)
+    def md5(self, name, version):
+        return hashlib.md5(self.jar(name, version)).hexdigest()
+
+    def listing(self, stage, page):
+        indexes = [i for i in range(self.plugins) if self.stage(i)[0] == stage]
+        rows = [LISTING_ROW % {'name': self.name(i), 'index': i, 'stage': self.stage(i)[1]}
+                for i in indexes[(page - 1) * self.per_page:page * self.per_page]]
+        return PAGE % ('Plugins', LISTING % '\n'.join(rows))
+
+    def files(self, name):
+        rows = [FILES_ROW % {'name': name, 'id': 1000 + i, 'version': v}
+                for i, v in enumerate(self.version_names())]
+        return PAGE % ('Files', FILES % '\n'.join(rows))
+
+    def file(self, base, name, version):
+        return PAGE % ('File', FILE % {'base': base, 'name': name, 'version': version,
+                                       'md5': self.md5(name, version)})
+
+
+class FakeBukkitDevHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write, so keep-alive requests are not held by delayed acks
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, mime='text/html; charset=utf-8'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        catalog = server.catalog
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts == ['bukkit-plugins']:
+            self.send(200, catalog.listing(query.get('stage', ['r'])[0], page))
+        elif len(parts) >= 3 and parts[0] == 'bukkit-plugins' and parts[2] == 'files' \
+                and catalog.has_plugin(parts[1]):
+            if len(parts) == 3:
+                # every version fits on the first page, BukkitDev answers 404 past the last one
+                if page == 1:
+                    self.send(200, catalog.files(parts[1]))
+                else:
+                    self.send(404, 'Not found')
+            else:
+                version = parts[3].rsplit('-v', 1)[-1]
+                self.send(200, catalog.file(server.base, parts[1], version))
+        elif len(parts) == 4 and parts[:2] == ['media', 'files'] and catalog.has_plugin(parts[2]):
+            self.send(200, catalog.jar(parts[2], parts[3][:-len('.jar')]), mime='application/java-archive')
+        else:
+            self.send(404, 'Not found')
+
+
+class FakeBukkitDev(ThreadingHTTPServer):
+    """
+    Serves a Catalog the way dev.bukkit.org did, on localhost
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, catalog: Catalog, port=0, latency=0.0):
+        super().__init__(('localhost', port), FakeBukkitDevHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.base = 'http://localhost:%s' % self.server_address[1]
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for dev.bukkit.org')
+    parser.add_argument('--port', type=int, default=8150)
+    parser.add_argument('--plugins', type=int, default=2000)
+    parser.add_argument('--versions', type=int, default=3)
+    parser.add_argument('--jar-size', type=int, default=64 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every response, in seconds')
+    args = parser.parse_args()
+
+    server = FakeBukkitDev(Catalog(args.plugins, args.versions, args.jar_size), args.port, args.latency)
+    print('Serving %s plugins at %s' % (args.plugins, server.base))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,12 @@ from baker import run
 
 from blackdog.exception import *
 from blackdog.bukkitdev import BukkitDev, PluginStage, Plugin, PluginVersion
-from blackdog.server import HTTPServer
+from blackdog.storage import FileStorage, SQLiteStorage
+from blackdog.index import SearchIndex
+from blackdog.server import HTTPServer, ThreadPoolHTTPServer
+from blackdog.store import ArtifactStore
+from blackdog.upstream import Upstream
+from blackdog.aioserver import AsyncHTTPServer
 
 
 class BlackDog(object):
@@ -41,7 +46,12 @@ class BlackDog(object):
         self.logger = logging.getLogger('BlackDog')
         self.directory = expanduser('~/.blackdog/')
         os.makedirs(self.directory, mode=0o755, exist_ok=True)
-        self.bukkitdev = BukkitDev(self.directory)
+        self.database = join(self.directory, 'metadata.db')
+        storage = SQLiteStorage(self.database) if exists(self.database) else FileStorage(self.directory)
+        self.upstream = Upstream()
+        self.bukkitdev = BukkitDev(self.directory, storage, self.upstream)
+        self.store = ArtifactStore(join(self.directory, 'artifacts'), upstream=self.upstream)
+        self.index = SearchIndex(join(self.directory, 'index.json.gz'), storage)
         self.pidfile = join(self.directory, '.pid')
 
     def main(self):
@@ -59,10 +69,18 @@ class BlackDog(object):
                 return False
         return True
 
-    def get_server_pid(self):
+    def get_server_pids(self):
+        """
+        :return: the pids of the server, the master process first when it runs workers
+        """
         if exists(self.pidfile):
             with open(self.pidfile, 'r') as f:
-                return int(f.read())
+                return [int(line) for line in f.read().split()]
+        return []
+
+    def get_server_pid(self):
+        pids = self.get_server_pids()
+        return pids[0] if pids else None
 
     def is_server_running(self):
         pid = self.get_server_pid()
@@ -0,0 +1,158 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from blackdog import extract
+from blackdog.bukkitdev import BukkitDev
+from blackdog.metrics import CACHE
+from blackdog.plugin import Plugin, PluginVersion
+
+
+class AsyncBukkitDev(object):
+    """
+    Asynchronous front-end to a BukkitDev instance.
+    Upstream requests are run on a bounded executor, so that the metadata
+    pages of all the versions listed on a files page are fetched at once.
+    """
+
+    def __init__(self, bukkitdev: BukkitDev, concurrency=16):
+        self.bukkitdev = bukkitdev
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.logger = logging.getLogger('AsyncBukkitDev')
+        self.flights = {}
+
+    async def _run(self, fun, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, fun, *args)
+
+    async def _query(self, url, plugin: Plugin=None):
+        r = await self._run(self.bukkitdev._get, url, plugin)
+        return r.status_code, extract.parse(r.text) if r.status_code == 200 else None
+
+    async def _fill_version_meta(self, version: PluginVersion, metalink):
+        status, d = await self._query(self.bukkitdev.base + metalink, version.get_plugin())
+        if d is None:
+            raise ValueError('no metadata page for version %s' % version.get_version())
+        self.bukkitdev._parse_version_meta(version, d)
+
+    def _add_versions(self, plugin: Plugin, versions):
+        # the refresher, the flusher and the synchronous lookups change the cached plugin under its lock
+        with self.bukkitdev.locks(plugin.path_name):
+            for v in versions:
+                plugin.add_version(v)
+
+    async def _fill_plugin_meta(self, plugin: Plugin, version=None):
+        self.logger.info('Getting metadata for plugin %s...', plugin.name)
+        errors = False
+        complete = False
+        try:
+            page = 1
+            while True:
+                status, d = await self._query(self.bukkitdev._files_url(plugin, page), plugin)
+                if page == 1 and status in (200, 404):
+                    plugin.exists(status == 200)
+                if d is None:
+                    # BukkitDev answers 404 past the last page
+                    complete = status == 404 and not errors
+                    if version is None and complete:
+                        plugin.listed(True)
+                    break
+
+                files = [(v, link) for v, link in self.bukkitdev._parse_files(d) if v and link]
+                if version == 'latest':
+                    files = files[:1]
+                elif version:
+                    files = [(v, link) for v, link in files if v == version][:1]
+
+                versions = [PluginVersion(plugin, v) for v, link in files]
+                for v in versions:
+                    self.logger.info('\tRetrieving informations for version %s...', v.get_version())
+                results = await asyncio.gather(*[self._fill_version_meta(v, link)
+                                                 for v, (_, link) in zip(versions, files)],
+                                               return_exceptions=True)
+
+                fetched = []
+                for v, result in zip(versions, results):
+                    if isinstance(result, Exception):
+                        self.logger.error('\tCould not retrieve metadata for version %s', v.get_version())
+                        errors = True
+                        continue
+                    fetched.append(v)
+                await self._run(self._add_versions, plugin, fetched)
+
+                if version and fetched:
+                    break
+                page += 1
+        finally:
+            await self._run(self.bukkitdev.save_plugin, plugin)
+            self.bukkitdev._end_requests(plugin)
+        return complete
+
+    async def get_plugin(self, name, version=None, no_query=False):
+        """
+        Gets a plugin info from its name and version
+        :param name: the plugin name
+        :param version: the plugin version
+        :return: the plugin
+        """
+
+        plugin = self.bukkitdev.plugins.get(name)
+        if plugin is None:
+            plugin = await self._run(self.bukkitdev.get_cached_plugin, name)
+        else:
+            CACHE.inc('plugins', 'hit')
+
+        if no_query or self.bukkitdev.policy == 'offline' or self.bukkitdev.serve_stale(plugin, version):
+            return plugin
+
+        if not self.bukkitdev.is_known_miss(name, version):
+            key = (name, version)
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = asyncio.ensure_future(self._resolve_plugin(plugin, version))
+                flight.add_done_callback(lambda f: self.flights.pop(key, None))
+            plugin = await asyncio.shield(flight)
+
+        return plugin
+
+    async def get_version_list(self, name):
+        """
+        Gets a plugin with an up to date version list, see BukkitDev.get_version_list
+        :param name: the plugin name
+        :return: the plugin
+        """
+        plugin = await self.get_plugin(name, no_query=True)
+        if not plugin.versions:
+            plugin = await self.get_plugin(name)
+            if self.bukkitdev.policy == 'online':
+                self.bukkitdev.listings.put(name, True)
+            return plugin
+        return await self._run(self.bukkitdev.get_version_list, name)
+
+    async def _resolve_plugin(self, plugin: Plugin, version=None):
+        if self.bukkitdev._is_resolved(plugin, version):
+            return plugin
+
+        if await self._fill_plugin_meta(plugin, version):
+            self.bukkitdev.record_lookup(plugin, version)
+        return plugin
+
+    def close(self):
+        self.executor.shutdown(wait=False)
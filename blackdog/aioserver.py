@@ -0,0 +1,167 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import atexit
+import io
+
+from blackdog import BlackDogException
+from blackdog import metrics
+from blackdog.aiobukkitdev import AsyncBukkitDev
+from blackdog.server import RequestHandler, parse_maven_path
+
+
+class AsyncHTTPServer(object):
+    """
+    Serves the repository from an asyncio event loop, keeping idle
+    connections alive at the cost of a coroutine each.
+    """
+
+    def __init__(self, port, concurrency=16, backlog=1024, sock=None):
+        from blackdog import BlackDog
+        self.blackdog = BlackDog.instance
+        self.bukkitdev = AsyncBukkitDev(self.blackdog.bukkitdev, concurrency)
+        self.port = port
+        self.backlog = backlog
+        self.sock = sock
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+
+    def __enter__(self):
+        asyncio.set_event_loop(self.loop)
+        if self.sock is not None:
+            start = asyncio.start_server(self.handle_connection, sock=self.sock)
+        else:
+            start = asyncio.start_server(self.handle_connection, port=self.port, backlog=self.backlog)
+        self.server = self.loop.run_until_complete(start)
+        atexit.register(self.close)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        atexit.unregister(self.close)
+
+    def serve_forever(self):
+        self.loop.run_forever()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            if not self.loop.is_running():
+                self.loop.run_until_complete(self.server.wait_closed())
+            self.server = None
+        self.bukkitdev.close()
+
+    async def handle_connection(self, reader, writer):
+        await AsyncRequestHandler(self, reader, writer).handle()
+
+
+class AsyncRequestHandler(RequestHandler):
+    """
+    Request handler driven by asyncio streams.
+    Requests are parsed and answered by the synchronous RequestHandler
+    machinery against in-memory buffers, which are then written out to the
+    connection. Jar bodies are streamed from the artifact store afterwards.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    stream_downloads = False
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.client_address = writer.get_extra_info('peername') or ('', 0)
+        self.close_connection = True
+        self.file = None
+
+    async def handle(self):
+        try:
+            self.close_connection = False
+            while not self.close_connection:
+                await self.handle_one_request_async()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def handle_one_request_async(self):
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        self.rfile = io.BytesIO(head)
+        self.wfile = io.BytesIO()
+        self.file = None
+
+        self.raw_requestline = self.rfile.readline(65537)
+        if self.parse_request():
+            if self.command in ('GET', 'HEAD'):
+                await self.do_GET_async()
+            else:
+                self.close_connection = True
+                self.send_error(501, 'Unsupported method (%r)' % self.command)
+
+        await self.flush()
+
+    async def flush(self):
+        self.writer.write(self.wfile.getvalue())
+        await self.writer.drain()
+        if self.file:
+            path, offset, length = self.file
+            with open(path, 'rb') as f:
+                await asyncio.get_event_loop().sendfile(self.writer.transport, f, offset, length)
+
+    def copy_file(self, path, offset, length):
+        metrics.BYTES.inc('out', amount=length)
+        self.file = (path, offset, length)
+
+    async def do_GET_async(self):
+        blackdog = self.server.blackdog
+        bukkitdev = self.server.bukkitdev
+
+        self.request_type = None
+        self.response_started = False
+        if self.handle_endpoint():
+            return
+
+        self.maven_path = parse_maven_path(self.path)
+        if not self.maven_path:
+            self.send_not_found()
+            return
+        plugin_name, plugin_version = self.maven_path.artifactid, self.maven_path.version
+
+        try:
+            if plugin_version is None:
+                plugin = await bukkitdev.get_version_list(plugin_name)
+                if not plugin.versions or not await bukkitdev._run(self.handle_pattern, self.maven_path.filename, plugin):
+                    self.send_not_found()
+                return
+
+            plugin = await bukkitdev.get_plugin(plugin_name, no_query=True)
+            if not plugin.has_version(plugin_version) or not plugin.get_version(plugin_version).can_download():
+                plugin = await bukkitdev.get_plugin(plugin_name, version=plugin_version)
+
+            version = plugin.get_version(plugin_version)
+
+            if not await bukkitdev._run(self.handle_pattern, self.maven_path.filename, version):
+                self.send_not_found()
+
+        except BlackDogException as e:
+            blackdog.logger.error(e.message)
+            self.send_failure()
+        except Exception as e:
+            blackdog.logger.exception(e)
+            self.send_failure()
@@ -16,68 +16,236 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import atexit
 import logging
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from os.path import exists, join
+
+from blackdog import extract
+from blackdog.cache import LRUCache
+from blackdog.metrics import CACHE, REGISTRY, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+from blackdog.plugin import Plugin, PluginStage, PluginVersion
+from blackdog.refresher import Refresher
+from blackdog.storage import FileStorage
+from blackdog.sync import KeyedLock, RateLimiter, SingleFlight
+from blackdog.upstream import Upstream
 
-from pyquery import PyQuery
-import requests
 
-from blackdog.plugin import Plugin, PluginStage, PluginVersion
+POLICIES = ('online', 'swr', 'offline')
+
+_VERSION = re.compile(r'[0-9]+(\.[0-9]+)+')
 
 
 class BukkitDev(object):
 
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, storage=None, upstream=None):
         self.cache_dir = cache_dir
+        self.storage = storage or FileStorage(cache_dir)
+        self.upstream = upstream or Upstream()
         self.base = 'http://dev.bukkit.org'
         self.logger = logging.getLogger('BukkitDev')
+        self.locks = KeyedLock()
+        self.flights = SingleFlight()
+        self.rate_limiter = None
+        self.plugins = LRUCache(max_size=4096, ttl=3600)
+        self.misses = LRUCache(max_size=4096, ttl=300)
+        self.listings = LRUCache(max_size=4096, ttl=300)
+        self.request_counts = {}
+        self.resolved_plugins = 0
+        self.resolved_requests = 0
+        self._stats_lock = threading.Lock()
+        self.policy = 'online'
+        self.refresher = Refresher(self)
+        self.flush_interval = 1.0
+        self.dirty = {}
+        self._dirty_lock = threading.Lock()
+        self._flusher = None
+        # the flusher thread does not survive a fork
+        os.register_at_fork(after_in_child=self._reset_flusher)
+
+        REGISTRY.gauge('blackdog_resolved_plugins', 'Plugins resolved from BukkitDev',
+                       lambda: self.resolved_plugins)
+        REGISTRY.gauge('blackdog_resolved_requests', 'Requests sent to BukkitDev to resolve plugins',
+                       lambda: self.resolved_requests)
+
+    def set_policy(self, policy, fail_fast=30):
+        """
+        Sets how lookups use upstream:
+        'online' queries BukkitDev whenever the cache cannot answer, and waits for it;
+        'swr' (stale-while-revalidate) answers from the cache whenever it can,
+        refreshing it in the background, and fails fast while upstream is down;
+        'offline' never contacts upstream.
+        :param policy: one of 'online', 'swr' or 'offline'
+        :param fail_fast: with 'swr', the number of seconds upstream is skipped after a failure
+        """
+        if policy not in POLICIES:
+            raise ValueError('unknown policy %s' % policy)
+        self.policy = policy
+        self.upstream.offline = policy == 'offline'
+        self.upstream.fail_fast = fail_fast if policy == 'swr' else 0
 
     def save_plugin(self, plugin: Plugin):
-        return plugin.save(self.cache_dir)
+        with self.locks(plugin.path_name):
+            if self.plugins.get(plugin.name) is not plugin:
+                self.plugins.pop(plugin.name)
+            return plugin.save(self.storage)
+
+    def mark_dirty(self, plugin: Plugin):
+        """
+        Schedules the save of a plugin whose version checksums were filled in.
+        Saves are batched by a background thread, every flush_interval seconds,
+        so that hot paths do not rewrite the plugin file synchronously.
+        """
+        with self._dirty_lock:
+            self.dirty[plugin.name] = plugin
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever, name='Flusher', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        """
+        Saves the plugins marked dirty
+        :return: the number of saved plugins
+        """
+        with self._dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+
+        for name, plugin in dirty.items():
+            try:
+                with self.locks(plugin.path_name):
+                    current = self.get_cached_plugin(name)
+                    if current is not plugin:
+                        # a newer copy replaced this one, carry the checksums over to it
+                        for vstr, version in list(plugin.versions.items()):
+                            if current.has_version(vstr) and not current.get_version(vstr).sha1():
+                                current.get_version(vstr).sha1(version.sha1())
+                    self.save_plugin(current)
+            except Exception as e:
+                self.logger.error('Could not save plugin %s: %s', name, e)
+        return len(dirty)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _reset_flusher(self):
+        self._dirty_lock = threading.Lock()
+        self._flusher = None
 
     def load_plugin(self, plugin: Plugin):
-        return plugin.load(self.cache_dir)
+        with self.locks(plugin.path_name):
+            return plugin.load(self.storage)
+
+    def _get(self, url, plugin: Plugin=None):
+        """
+        Sends a GET request to BukkitDev
+        :param url: the requested url
+        :param plugin: the plugin being resolved, whose request count is increased
+        :return: the response
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        if plugin:
+            with self._stats_lock:
+                self.request_counts[plugin.name] = self.request_counts.get(plugin.name, 0) + 1
+
+        with UPSTREAM_SECONDS.time('page'):
+            try:
+                r = self.upstream.get(url)
+            except Exception:
+                UPSTREAM_ERRORS.inc('page')
+                raise
+        if r.status_code >= 500:
+            UPSTREAM_ERRORS.inc('page')
+        return r
+
+    def _query(self, url, plugin: Plugin=None):
+        return extract.parse(self._get(url, plugin).text)
+
+    def _end_requests(self, plugin: Plugin):
+        with self._stats_lock:
+            count = self.request_counts.pop(plugin.name, 0)
+            self.resolved_plugins += 1
+            self.resolved_requests += count
+        self.logger.info('Resolved plugin %s in %s upstream requests', plugin.name, count)
+
+    def _files_url(self, plugin: Plugin, page):
+        return '/'.join([self.base,
+                         'bukkit-plugins',
+                         plugin.name,
+                         'files',
+                         '?page=%s' % page if page > 1 else ''])
 
     def _fill_version_meta(self, version: PluginVersion, metalink):
-        d = PyQuery(url=self.base + metalink)
-        path = '#bd section.main .main-body .main-body-inner .line .lastUnit .content-box .content-box-inner dl'
-        info = d(path).children()
-        meta = dict([(PyQuery(dt).text(), PyQuery(dd)) for dt, dd in zip(info[::2], info[1::2])])
-
-        version.md5(meta['MD5'].text())
-        version.stage(meta['Type'].text())
-        version.date(meta['Uploaded on'].text())
-        version.game_versions([v.text() for v in meta['Game version']('ul li').items()])
-        version.url(meta['Filename']('a').eq(0).attr('href'))
-
-    def _fill_plugin_meta(self, plugin: Plugin, version=None):
+        self._parse_version_meta(version, self._query(self.base + metalink, version.get_plugin()))
+
+    @staticmethod
+    def _parse_version_meta(version: PluginVersion, d):
+        meta = extract.version_meta(d)
+
+        version.md5(extract.text(meta['MD5']))
+        version.stage(PluginStage.from_string(extract.text(meta['Type'])))
+        version.date(extract.text(meta['Uploaded on']))
+        version.game_versions(extract.list_items(meta['Game version']))
+        version.url(extract.first_link(meta['Filename']))
+
+    @staticmethod
+    def _parse_files(d):
+        """
+        Lists the jar files of a plugin files page
+        :param d: the parsed files page
+        :return: a list of (version, metadata link) tuples
+        """
+        files = []
+        for row in extract.file_rows(d):
+            if 'col-filename' not in row or not extract.text(row['col-filename']).endswith('.jar'):
+                continue
+            name = extract.text(row.get('col-file'))
+            match = _VERSION.search(name)
+            files.append((match.group(0) if match else name, extract.first_link(row.get('col-file'))))
+        return files
+
+    def _fill_plugin_meta(self, plugin: Plugin, version=None, incremental=False):
+        """
+        Lists the versions of a plugin from its files pages, and fetches their metadata
+        :return: whether the walk ended on the last page with no error, so that what was
+                 not found does not exist
+        """
+        with self.locks(plugin.path_name):
+            return self._do_fill_plugin_meta(plugin, version, incremental)
+
+    def _do_fill_plugin_meta(self, plugin: Plugin, version=None, incremental=False):
         self.logger.info('Getting metadata for plugin %s...', plugin.name)
+        errors = False
+        complete = False
         try:
-            if not requests.head('/'.join([self.base, 'bukkit-plugins', plugin.name, ''])).ok:
-                plugin.exists(False)
-                return
-
             page = 1
             while True:
-                page_url = '/'.join([self.base,
-                                     'bukkit-plugins',
-                                     plugin.name,
-                                     'files',
-                                     '?page=%s' % page if page > 1 else ''])
-
-                code = requests.head(page_url).status_code
-                if code != 200:
+                r = self._get(self._files_url(plugin, page), plugin)
+                if page == 1 and r.status_code in (200, 404):
+                    plugin.exists(r.status_code == 200)
+                if r.status_code != 200:
+                    # BukkitDev answers 404 past the last page
+                    complete = r.status_code == 404 and not errors
+                    if version is None and complete:
+                        plugin.listed(True)
                     break
 
-                d = PyQuery(url=page_url)
-                list = [tr for tr in d('table.listing tbody tr').items()
-                        if tr('td.col-filename').text().endswith('.jar')]
-
-                for tr in list:
-                    version_str = ''
+                for version_str, metalink in self._parse_files(extract.parse(r.text)):
                     try:
-                        version_str = re.sub(r'.*?([0-9]+(\.[0-9]+)+).*', '\\1', tr('td.col-file').text())
-                        metalink = tr('td.col-file a').attr('href')
+                        if incremental and plugin.listed() and plugin.has_version(version_str) \
+                                and plugin.get_version(version_str).can_download():
+                            # files are listed newest first, older versions are known as well
+                            # once a complete walk listed them
+                            break
+
                         version_found = version == version_str or version == 'latest'
                         if metalink and version_str and (not version or version_found):
                             pversion = PluginVersion(plugin, version_str)
@@ -88,6 +256,7 @@ class BukkitDev(object):
                                 break
                     except:
                         self.logger.error('\tCould not retrieve metadata for version %s', version_str)
+                        errors = True
                         continue
                 else:
                     page += 1
@@ -95,6 +264,8 @@ class BukkitDev(object):
                 break
         finally:
             self.save_plugin(plugin)
+            self._end_requests(plugin)
+        return complete
 
     @staticmethod
     def _to_post_arg(args):
@@ -117,13 +288,120 @@ class BukkitDev(object):
         :return: the plugin
         """
 
-        plugin = Plugin(name).load(self.cache_dir)
+        plugin = self.get_cached_plugin(name)
+
+        if no_query or self.policy == 'offline' or self.serve_stale(plugin, version):
+            return plugin
+
+        if not self.is_known_miss(name, version):
+            plugin = self.flights.do((name, version), self._resolve_plugin, plugin, version)
+
+        return plugin
+
+    def get_version_list(self, name):
+        """
+        Gets a plugin with an up to date version list, as listed in its maven-metadata.xml.
+        Under the 'online' policy, the versions published since the list was cached
+        are queried at most once per listing interval.
+        :param name: the plugin name
+        :return: the plugin
+        """
+        plugin = self.get_cached_plugin(name)
+        if not plugin.versions or self.policy != 'online':
+            plugin = self.get_plugin(name)
+        elif not self.listings.get(name) and self.upstream.is_available():
+            try:
+                plugin = self.refresh_plugin(name)
+            except Exception as e:
+                self.logger.error('Could not refresh the versions of %s: %s', name, e)
+                return plugin
+        else:
+            return plugin
+
+        self.listings.put(name, True)
+        return plugin
+
+    def serve_stale(self, plugin: Plugin, version=None):
+        """
+        Under the 'swr' policy, tells whether a lookup is answered from the cache.
+        Cached version lists are served right away and refreshed in the background,
+        as is any lookup while upstream is unavailable.
+        :return: whether the cached plugin should be returned without querying upstream
+        """
+        if self.policy != 'swr':
+            return False
+        if self._is_resolved(plugin, version):
+            return True
+        if ((version is None or version == 'latest') and plugin.versions) or not self.upstream.is_available():
+            self.refresher.schedule(plugin.name, version)
+            return True
+        return False
+
+    def refresh_plugin(self, name, version=None):
+        """
+        Queries upstream for the new versions of a cached plugin
+        :param name: the plugin name
+        :param version: the looked up version, None for the version list
+        :return: the plugin
+        """
+        plugin = self.get_cached_plugin(name)
+        return self.flights.do((name, version), self._refresh_plugin, plugin, version)
+
+    def _refresh_plugin(self, plugin: Plugin, version=None):
+        # the incremental walk stops at the first cached version, which only lists
+        # the older versions as well once a complete walk did
+        incremental = bool(plugin.listed()) and version in (None, 'latest')
+        if self._fill_plugin_meta(plugin, version, incremental=incremental):
+            self.record_lookup(plugin, version)
+        return plugin
+
+    @staticmethod
+    def _is_resolved(plugin: Plugin, version=None):
+        return version and version != 'latest' and plugin.has_version(version) \
+            and plugin.get_version(version).can_download()
 
-        if not no_query:
-            self._fill_plugin_meta(plugin, version)
+    def _resolve_plugin(self, plugin: Plugin, version=None):
+        if self._is_resolved(plugin, version):
+            # resolved by a call that completed while this one was being set up
+            return plugin
 
+        if self._fill_plugin_meta(plugin, version):
+            self.record_lookup(plugin, version)
         return plugin
 
+    def get_cached_plugin(self, name):
+        """
+        Gets a plugin info from the memory cache, loading it from storage on a miss
+        :param name: the plugin name
+        :return: the plugin
+        """
+        plugin = self.plugins.get(name)
+        if plugin is None:
+            CACHE.inc('plugins', 'miss')
+            plugin = self.load_plugin(Plugin(name))
+            self.plugins.put(name, plugin)
+        else:
+            CACHE.inc('plugins', 'hit')
+        return plugin
+
+    def is_known_miss(self, name, version=None):
+        """
+        :return: whether the plugin or version was recently looked up in vain
+        """
+        if self.misses.get((name, None)) or self.misses.get((name, version)):
+            self.logger.info('Skipping lookup of unknown plugin %s %s', name, version or '')
+            return True
+        return False
+
+    def record_lookup(self, plugin: Plugin, version=None):
+        """
+        Remembers a missing plugin or version for a while, after a lookup that listed every version
+        """
+        if plugin.exists() is False:
+            self.misses.put((plugin.name, None), True)
+        elif version and version != 'latest' and not plugin.has_version(version):
+            self.misses.put((plugin.name, version), True)
+
     def search(self, **kwargs):
         """
         Searchs for a plugin
@@ -135,38 +413,103 @@ class BukkitDev(object):
         """
 
         results = []
-        page_content = PyQuery(url='/'.join([self.base, 'bukkit-plugins', '?%s' % self._to_post_arg(kwargs)]))
-        plugin_table = page_content('#bd .line .unit .listing-container .listing-container-inner table tbody tr')
+        page_content = self._query('/'.join([self.base, 'bukkit-plugins', '?%s' % self._to_post_arg(kwargs)]))
 
-        for (info, summary) in zip(plugin_table[::2], plugin_table[1::2]):
-            info = PyQuery(info)
-            plugin = Plugin(name=info('td.col-project h2 a').attr('href').split('/')[2])
-            plugin.display_name(re.sub('</?mark>', '', info('td.col-project h2 a').html()))
-            plugin.stage(PluginStage.from_string(info('td.col-status').text()))
-            plugin.summary(re.sub('</?mark>', '', PyQuery(summary)('td.summary').html()))
+        for info, summary in extract.plugin_rows(page_content):
+            link = extract.project_link(info['col-project'])
+            plugin = Plugin(name=link.get('href').split('/')[2])
+            plugin.display_name(extract.inner_html(link))
+            plugin.stage(PluginStage.from_string(extract.text(info.get('col-status'))))
+            plugin.summary(extract.inner_html(summary.get('summary')))
 
             results.append(plugin)
 
         return results
 
-    def scan(self, stages=None):
+    def _scan_plugin(self, plugin: Plugin, incremental=False):
+        try:
+            if incremental:
+                cached = self.load_plugin(Plugin(plugin.name))
+                cached.display_name(plugin.display_name())
+                cached.stage(plugin.stage())
+                cached.summary(plugin.summary())
+                plugin = cached
+            self._fill_plugin_meta(plugin, incremental=incremental)
+        except Exception:
+            self.logger.error('Could not process plugin %s', plugin.name)
+
+    def _get_checkpoint(self):
+        return join(self.cache_dir, '.scan')
+
+    def load_checkpoint(self):
+        """
+        Loads the position reached by the last interrupted scan
+        :return: a (stage, page, last plugin) tuple, or None
+        """
+        config = ConfigParser()
+        config.read(self._get_checkpoint())
+        if not config.has_section('checkpoint'):
+            return None
+
+        section = config['checkpoint']
+        return PluginStage.from_string(section['stage']), int(section['page']), section.get('plugin')
+
+    def save_checkpoint(self, stage: PluginStage, page, plugin: Plugin):
+        config = ConfigParser()
+        config['checkpoint'] = {'stage': stage.name, 'page': page, 'plugin': plugin.name}
+        with open(self._get_checkpoint(), 'w') as fd:
+            config.write(fd)
+
+    def clear_checkpoint(self):
+        if exists(self._get_checkpoint()):
+            os.remove(self._get_checkpoint())
+
+    def scan(self, stages=None, jobs=1, rate=None, incremental=False):
+        """
+        Fetches the metadata of every plugin listed for the given stages
+        :param stages: the development stages to scan, release and mature by default
+        :param jobs: the number of plugins processed concurrently
+        :param rate: the maximum number of upstream requests per second, unbounded if None
+        :param incremental: resume the last interrupted scan, and only fetch versions missing from the cache
+        """
         if not stages:
             stages = [PluginStage.release, PluginStage.mature]
 
+        self.rate_limiter = RateLimiter(rate) if rate else None
+
+        checkpoint = self.load_checkpoint() if incremental else None
+        if checkpoint and checkpoint[0] in stages:
+            stages = stages[stages.index(checkpoint[0]):]
+            self.logger.info('Resuming scan at stage \'%s\', page %s', checkpoint[0].name, checkpoint[1])
+        else:
+            checkpoint = None
+
         self.logger.info('Scanning %s', self.base)
-        for stage in stages:
-            self.logger.info('Processing plugins for stage \'%s\'', stage.name)
-            page = 1
-            more = True
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for stage in stages:
+                self.logger.info('Processing plugins for stage \'%s\'', stage.name)
+                page = 1
+                more = True
+
+                if checkpoint:
+                    page = checkpoint[1]
+
+                while more:
+                    self.logger.info('processing page %s...', page)
+                    plugins = self.search(stage=stage.value, page=page)
+                    more = len(plugins) > 0
+
+                    if checkpoint:
+                        names = [p.name for p in plugins]
+                        if checkpoint[2] in names:
+                            plugins = plugins[names.index(checkpoint[2]) + 1:]
+                        checkpoint = None
+
+                    futures = [(p, executor.submit(self._scan_plugin, p, incremental)) for p in plugins]
+                    for plugin, future in futures:
+                        future.result()
+                        self.save_checkpoint(stage, page, plugin)
 
-            while more:
-                self.logger.info('processing page %s...', page)
-                plugins = self.search(stage=stage.value, page=page)
-                for plugin in plugins:
-                    try:
-                        self._fill_plugin_meta(plugin)
-                    except Exception:
-                        self.logger.error('Could not process plugin %s', plugin.name)
+                    page += 1
 
-                more = len(plugins) > 0
-                page += 1
\ No newline at end of file
+        self.clear_checkpoint()
\ No newline at end of file
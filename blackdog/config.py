@@ -17,14 +17,25 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import re
+from collections import namedtuple
 from configparser import ConfigParser
 from enum import Enum
 from functools import wraps
 
+ConfigField = namedtuple('ConfigField', ['node', 'type', 'section', 'attribute', 'default'])
+
+
+def config_attribute(node):
+    """
+    :return: the name of the attribute holding the value of a config node,
+             to be listed in the __slots__ of the classes using it
+    """
+    return '_config_' + re.sub(r'[^a-zA-Z0-9_]', '_', node)
+
 
 def config_node(node, type=str, section=None):
     def decorator(fun):
-        config_field = '__config__' + re.sub(r'[^a-zA-Z0-9_]', '_', node)
+        config_field = config_attribute(node)
 
         @wraps(fun)
         def wrapper(self, *args, **kwargs):
@@ -42,42 +53,57 @@ def config_node(node, type=str, section=None):
         wrapper.config_node = node
         wrapper.config_type = type
         wrapper.config_section = section
+        wrapper.config_attribute = config_field
+        wrapper.config_default = fun
 
         return wrapper
     return decorator
 
 
+def schema(cls):
+    """
+    Lists the config nodes of a class, once per class
+    :return: a tuple of ConfigFields
+    """
+    fields = cls.__dict__.get('_config_schema')
+    if fields is None:
+        methods = {}
+        for klass in reversed(cls.__mro__):
+            methods.update((n, m) for n, m in vars(klass).items() if hasattr(m, 'config_node'))
+        fields = tuple(ConfigField(m.config_node, m.config_type, m.config_section, m.config_attribute, m.config_default)
+                       for n, m in sorted(methods.items()))
+        setattr(cls, '_config_schema', fields)
+    return fields
+
+
 def load(config: ConfigParser, obj, section):
-    attrs = [(f, getattr(obj, f)) for f in dir(obj)]
-    for name, method in [(n, m) for (n, m) in attrs if callable(m) and hasattr(m, 'config_node')]:
-        real_section = method.config_section if method.config_section else section
-        val = config.get(real_section, method.config_node, fallback=None)
+    for field in schema(type(obj)):
+        real_section = field.section if field.section else section
+        val = config.get(real_section, field.node, fallback=None)
 
         if val:
-            if method.config_type == list:
+            if field.type == list:
                 val = [e.strip() for e in val.split(',')]
-            elif method.config_type == bool:
+            elif field.type == bool:
                 try:
-                    val = config.getboolean(real_section, method.config_node, fallback=None)
+                    val = config.getboolean(real_section, field.node, fallback=None)
                 except ValueError:
                     val = None
-            elif issubclass(method.config_type, Enum):
-                val = method.config_type.from_string(val)
-
-            method(val)
+            elif issubclass(field.type, Enum):
+                val = field.type.from_string(val)
         else:
-            method(method(default=True))
+            val = field.default(obj)
+
+        setattr(obj, field.attribute, val)
 
 
 def save(config: ConfigParser, obj, section):
-    attrs = [(f, getattr(obj, f)) for f in dir(obj)]
-    nodes = [(n, m) for (n, m) in attrs if callable(m) and hasattr(m, 'config_node')]
-    for name, method in nodes:
-        real_section = method.config_section if method.config_section else section
-        val = method()
+    for field in schema(type(obj)):
+        real_section = field.section if field.section else section
+        val = getattr(obj, field.attribute) if hasattr(obj, field.attribute) else field.default(obj)
 
         if val:
-            if method.config_type == list:
+            if field.type == list:
                 val = ', '.join(val)
             elif isinstance(val, Enum):
                 val = val.name
@@ -86,4 +112,4 @@ def save(config: ConfigParser, obj, section):
 
             if not config.has_section(real_section):
                 config.add_section(real_section)
-            config.set(real_section, method.config_node, val)
\ No newline at end of file
+            config.set(real_section, field.node, val)
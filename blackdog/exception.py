@@ -42,4 +42,15 @@ class NoSuchPluginException(BlackDogException):
 
 class NoSuchPluginVersionException(BlackDogException):
     def __init__(self, version):
-        super().__init__('Version ${version} could not be found', version, version=version)
\ No newline at end of file
+        super().__init__('Version ${version} could not be found', version, version=version)
+
+
+class ArtifactUnavailableException(BlackDogException):
+    def __init__(self, version):
+        super().__init__('Artifact of ${name} ${version} could not be downloaded', version,
+                         name=version.get_plugin().name, version=version.get_version())
+
+
+class UpstreamUnavailableException(BlackDogException):
+    def __init__(self, url):
+        super().__init__('Upstream is unavailable, not requesting ${url}', url, url=url)
@@ -0,0 +1,122 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Extraction of the data scraped from BukkitDev pages.
+Each page is parsed once, rows are located with precompiled XPath
+expressions, and their cells are looked up by class on the row children.
+"""
+import re
+from xml.sax.saxutils import escape
+
+import lxml.html
+from lxml import etree
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+
+_VERSION_META = etree.XPath("//*[@id='bd']//section[%s]//*[%s]//*[%s]//dl/*"
+                            % (_has_class('main'), _has_class('lastUnit'), _has_class('content-box-inner')))
+_FILE_ROWS = etree.XPath("//table[%s]/tbody/tr" % _has_class('listing'))
+_PLUGIN_ROWS = etree.XPath("//*[@id='bd']//*[%s]//*[%s]//table/tbody/tr"
+                           % (_has_class('listing-container'), _has_class('listing-container-inner')))
+_PROJECT_LINK = etree.XPath(".//h2//a")
+_LINKS = etree.XPath(".//a/@href")
+_ITEMS = etree.XPath(".//ul//li")
+_MARK = re.compile('</?mark>')
+
+
+def parse(text):
+    """
+    :param text: the page source
+    :return: the root element of the page
+    """
+    return lxml.html.fromstring(text)
+
+
+def text(element):
+    """
+    :return: the text content of an element, with whitespace collapsed
+    """
+    return ' '.join(element.text_content().split()) if element is not None else ''
+
+
+def inner_html(element):
+    """
+    :return: the markup of the children of an element, without <mark> highlighting
+    """
+    if element is None:
+        return None
+    html = escape(element.text or '')
+    if len(element):
+        html += ''.join(etree.tostring(child, encoding=str) for child in element)
+        html = _MARK.sub('', html)
+    return html
+
+
+def first_link(element):
+    links = _LINKS(element) if element is not None else None
+    return links[0] if links else None
+
+
+def project_link(cell):
+    """
+    :return: the project link of a listing cell
+    """
+    return _PROJECT_LINK(cell)[0]
+
+
+def cells(row):
+    """
+    :return: the cells of a table row, by class name
+    """
+    found = {}
+    for cell in row:
+        for name in cell.get('class', '').split():
+            found.setdefault(name, cell)
+    return found
+
+
+def version_meta(root):
+    """
+    Reads the definition list of a file page
+    :return: a dictionary of the definitions, by term
+    """
+    items = _VERSION_META(root)
+    return dict((text(dt), dd) for dt, dd in zip(items[::2], items[1::2]))
+
+
+def list_items(element):
+    return [text(li) for li in _ITEMS(element)]
+
+
+def file_rows(root):
+    """
+    :return: the cells of each row of a files page
+    """
+    return [cells(tr) for tr in _FILE_ROWS(root)]
+
+
+def plugin_rows(root):
+    """
+    Lists the plugins of a listing page, where each plugin spans two rows
+    :return: a list of (info cells, summary cells) tuples
+    """
+    rows = _PLUGIN_ROWS(root)
+    return [(cells(info), cells(summary)) for info, summary in zip(rows[::2], rows[1::2])]
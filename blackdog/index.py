@@ -0,0 +1,184 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from os.path import dirname, exists, getmtime
+
+from blackdog.plugin import Plugin, PluginStage
+from blackdog.storage import get_storage
+
+IndexEntry = namedtuple('IndexEntry', ['name', 'display_name', 'summary', 'stage', 'game_versions'])
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+_TAG = re.compile(r'<[^>]*>')
+
+
+def tokenize(text):
+    """
+    :return: the lowercase words and numbers of a text, markup excluded
+    """
+    return _TOKEN.findall(_TAG.sub(' ', text).lower()) if text else []
+
+
+class SearchIndex(object):
+    """
+    Local search over the cached plugin metadata, so that searching does not
+    depend on BukkitDev. The entries are persisted as gzipped JSON, and the
+    sorted token table is rebuilt from them whenever the file is loaded.
+    The file is reloaded when another process, like a scan, rewrites it.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, storage):
+        """
+        :param path: the file the index is persisted to
+        :param storage: the MetadataStorage holding the plugins
+        """
+        self.path = path
+        self.storage = get_storage(storage)
+        self.logger = logging.getLogger('SearchIndex')
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.builder = None
+        # entries, the words of their names, sorted tokens, and the entry ids of each token
+        self.tables = ([], [], [], [])
+
+    def build(self):
+        """
+        Indexes every stored plugin, and persists the index
+        :return: the number of indexed plugins
+        """
+        start = time.monotonic()
+        entries = []
+        for name in sorted(self.storage.names()):
+            plugin = Plugin(name).load(self.storage)
+            if plugin.exists() is False:
+                continue
+            stage = plugin.stage()
+            if not isinstance(stage, PluginStage):
+                stage = PluginStage.from_string(stage)
+            game_versions = set()
+            for version in plugin.versions.values():
+                game_versions.update(version.game_versions() or [])
+            entries.append(IndexEntry(name, plugin.display_name(), plugin.summary(),
+                                      stage.name if stage else None, sorted(game_versions)))
+
+        self.save(entries)
+        self.logger.info('Indexed %s plugins in %.1fs', len(entries), time.monotonic() - start)
+        return len(entries)
+
+    def save(self, entries):
+        fd, tmp = tempfile.mkstemp(dir=dirname(self.path), prefix='.index.', suffix='.tmp')
+        try:
+            with gzip.open(os.fdopen(fd, 'wb'), 'wt', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'plugins': [list(e) for e in entries]}, f,
+                          separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        with self.lock:
+            self._set(entries, getmtime(self.path))
+
+    def load(self, wait=True):
+        """
+        Loads the persisted index, building it in the background when there is none
+        :param wait: whether to wait for the index to be built, rather than keep the current one meanwhile
+        """
+        with self.lock:
+            mtime = getmtime(self.path) if exists(self.path) else None
+            if mtime is not None and mtime == self.mtime:
+                return
+
+            if mtime is not None:
+                with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.VERSION:
+                    self._set([IndexEntry(*e) for e in data['plugins']], mtime)
+                    return
+
+            # a single build at a time, reading every stored plugin
+            if self.builder is None or not self.builder.is_alive():
+                self.builder = threading.Thread(target=self.build, name='SearchIndex', daemon=True)
+                self.builder.start()
+            builder = self.builder
+
+        if wait:
+            builder.join()
+
+    def _set(self, entries, mtime):
+        postings = {}
+        names = []
+        for i, entry in enumerate(entries):
+            names.append(tokenize(entry.name) + tokenize(entry.display_name))
+            for token in set(names[-1] + tokenize(entry.summary)):
+                postings.setdefault(token, []).append(i)
+        tokens = sorted(postings)
+        self.tables = (entries, names, tokens, [postings[t] for t in tokens])
+        self.mtime = mtime
+
+    def search(self, query, stage=None, game_version=None, limit=None, wait=True):
+        """
+        Finds the plugins matching every word of a query, each word matching
+        the beginning of a word of their name, display name or summary
+        :param query: the words to search, or None to list every plugin
+        :param stage: only keep the plugins in this PluginStage
+        :param game_version: only keep the plugins with a version for this game version
+        :param limit: the maximum number of results
+        :param wait: whether to wait for a missing index to be built, rather than find nothing meanwhile
+        :return: the matching IndexEntries, those matching the query by name first
+        """
+        self.load(wait)
+        entries, names, tokens, postings = self.tables
+        terms = tokenize(query)
+
+        ids = None
+        for term in terms:
+            matches = set()
+            i = bisect.bisect_left(tokens, term)
+            while i < len(tokens) and tokens[i].startswith(term):
+                matches.update(postings[i])
+                i += 1
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+
+        ids = ids if ids is not None else range(len(entries))
+        if stage:
+            ids = [i for i in ids if entries[i].stage == stage.name]
+        if game_version:
+            # whole version components: 1.7 matches CB 1.7.2-R0.3, 1.1 does not match 1.17.1
+            pattern = re.compile(r'(?<![0-9a-z.])%s(?![0-9a-z])' % re.escape(game_version.lower()))
+            ids = [i for i in ids if any(pattern.search(v.lower()) for v in entries[i].game_versions)]
+
+        def rank(i):
+            return (-sum(1 for t in terms if any(w.startswith(t) for w in names[i])),
+                    (entries[i].display_name or entries[i].name).lower())
+        results = [entries[i] for i in sorted(ids, key=rank)]
+        return results[:limit] if limit else results
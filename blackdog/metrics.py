@@ -0,0 +1,238 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._render(key, value))
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonic count, per label values
+    """
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def _render(self, key, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labels, key), value)]
+
+
+class Gauge(Metric):
+    """
+    Value read from a callback whenever the metrics are rendered
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, callback):
+        super().__init__(name, help)
+        self.callback = callback
+
+    def render(self):
+        return ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind),
+                '%s %s' % (self.name, self.callback())]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets, per label values
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observes the duration of the with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def get(self, *labels):
+        """
+        :return: the (count, sum) of the observations
+        """
+        with self.lock:
+            entry = self.values.get(labels)
+            return (entry[1], entry[2]) if entry else (0, 0.0)
+
+    def quantile(self, q, *labels):
+        """
+        :return: the upper bound of the bucket holding the q-quantile, or None
+        """
+        with self.lock:
+            entry = self.values.get(labels)
+            if not entry or not entry[1]:
+                return None
+            rank, seen = q * entry[1], 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[0]):
+                seen += count
+                if seen >= rank:
+                    return bound
+
+    def _render(self, key, value):
+        counts, count, total = value
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + ('+Inf',), counts):
+            cumulative += n
+            lines.append('%s_bucket%s %s' % (self.name, _format_labels(self.labels, key, [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, _format_labels(self.labels, key), total))
+        lines.append('%s_count%s %s' % (self.name, _format_labels(self.labels, key), count))
+        return lines
+
+
+class Registry(object):
+    """
+    Set of metrics, rendered in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, callback):
+        return self.register(Gauge(name, help, callback))
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        return '\n'.join(line for m in metrics for line in m.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram('blackdog_request_seconds',
+                                     'Time spent answering repository requests, by request type', ['type'])
+RESPONSES = REGISTRY.counter('blackdog_responses_total', 'Responses sent, by request type and status', ['type', 'status'])
+CACHE = REGISTRY.counter('blackdog_cache_lookups_total', 'Cache lookups, by cache and result', ['cache', 'result'])
+UPSTREAM_SECONDS = REGISTRY.histogram('blackdog_upstream_seconds',
+                                      'Duration of the requests sent to BukkitDev, by kind', ['kind'])
+UPSTREAM_ERRORS = REGISTRY.counter('blackdog_upstream_errors_total',
+                                   'Failed requests sent to BukkitDev, by kind', ['kind'])
+BYTES = REGISTRY.counter('blackdog_bytes_total',
+                         'Artifact bytes downloaded from upstream (in) and sent to clients (out)', ['direction'])
+STORAGE_SECONDS = REGISTRY.histogram('blackdog_storage_seconds', 'Plugin metadata load and save time', ['operation'])
+
+
+def summary():
+    """
+    :return: a one-line digest of the metrics, for the logs
+    """
+    parts = []
+    with REQUEST_SECONDS.lock:
+        types = sorted(k[0] for k in REQUEST_SECONDS.values)
+    for kind in types:
+        count, total = REQUEST_SECONDS.get(kind)
+        parts.append('%s %s req %.1f/%.1f ms avg/p90' % (kind, count, total / count * 1000,
+                                                         REQUEST_SECONDS.quantile(0.9, kind) * 1000))
+
+    for cache in ['plugins', 'artifacts']:
+        hits, misses = CACHE.get(cache, 'hit'), CACHE.get(cache, 'miss')
+        if hits + misses:
+            parts.append('%s cache %.0f%% hits' % (cache, 100.0 * hits / (hits + misses)))
+
+    for kind in ['page', 'artifact']:
+        count, total = UPSTREAM_SECONDS.get(kind)
+        if count:
+            parts.append('upstream %s %s req %.0f ms avg' % (kind, count, total / count * 1000))
+
+    parts.append('%.1f MiB in, %.1f MiB out' % (BYTES.get('in') / 1048576.0, BYTES.get('out') / 1048576.0))
+    return ', '.join(parts)
+
+
+class Reporter(object):
+    """
+    Background thread logging a summary of the metrics at a fixed interval
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.logger = logging.getLogger('Metrics')
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='Metrics', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.logger.info(summary())
@@ -16,14 +16,21 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import bisect
+import calendar
 import hashlib
 import re
+import time
 from configparser import ConfigParser
 from enum import Enum
+from functools import lru_cache
 from string import Template
+from xml.sax.saxutils import escape
 
 from blackdog import NoSuchPluginVersionException
-from blackdog.config import load, save, config_node
+from blackdog.config import load, save, config_node, config_attribute
+from blackdog.metrics import STORAGE_SECONDS
+from blackdog.storage import get_storage
 
 
 class PluginStage(Enum):
@@ -41,11 +48,52 @@ class PluginStage(Enum):
         return getattr(PluginStage, string.lower(), None) if string else None
 
 
+_QUALIFIERS = {'alpha': 0, 'a': 0, 'beta': 1, 'b': 1, 'milestone': 2, 'm': 2, 'rc': 3, 'cr': 3,
+               'snapshot': 4, '': 5, 'ga': 5, 'final': 5, 'release': 5, 'sp': 6}
+
+
+def version_key(version):
+    """
+    Sort key ordering version strings like Maven does:
+    1-alpha < 1-beta < 1-rc < 1-SNAPSHOT < 1 = 1.0 < 1-sp < 1.0.1 < 1.1
+    :param version: the version string
+    :return: a key comparable with the keys of other versions
+    """
+    items = []
+    for token in re.findall(r'[0-9]+|[a-zA-Z]+', version.lower()) + ['']:
+        if token.isdigit():
+            items.append((2, int(token), ''))
+            continue
+        while items and items[-1] == (2, 0, ''):
+            items.pop()
+        items.append((1, _QUALIFIERS.get(token, 7), token))
+    return tuple(items)
+
+
 class Plugin(object):
+    __slots__ = ('name', 'path_name', 'versions', '__index', '__metadata') + \
+        tuple(config_attribute(node) for node in ['summary', 'display-name', 'stage', 'exists', 'listed'])
+
+    __METADATA_BASE = \
+        '<?xml version="1.0" encoding="UTF-8"?>\n' \
+        '<metadata>\n' \
+        '    <groupId>${groupid}</groupId>\n' \
+        '    <artifactId>${artifactid}</artifactId>\n' \
+        '    <versioning>\n' \
+        '${tags}' \
+        '        <versions>\n' \
+        '${versions}' \
+        '        </versions>\n' \
+        '${updated}' \
+        '    </versioning>\n' \
+        '</metadata>\n'
+
     def __init__(self, name):
         self.name = name
         self.path_name = re.sub(r'[^a-zA-Z0-9_\-]', '_', name)
         self.versions = {}
+        self.__index = []
+        self.__metadata = {}
 
     @config_node('summary')
     def summary(self):
@@ -63,8 +111,70 @@ class Plugin(object):
     def exists(self):
         return None
 
+    @config_node('listed', type=bool)
+    def listed(self):
+        """
+        :return: whether every version was listed by a complete walk of the files pages
+        """
+        return None
+
     def add_version(self, version):
-        self.versions[version.get_version()] = version
+        vstr = version.get_version()
+        known = vstr in self.versions
+        # indexed once listed, so that readers of the index always find the version
+        self.versions[vstr] = version
+        if not known:
+            bisect.insort(self.__index, (version_key(vstr), vstr))
+        self.__metadata.clear()
+
+    def get_sorted_versions(self):
+        """
+        :return: the version strings, from oldest to newest
+        """
+        return [vstr for key, vstr in self.__index]
+
+    def get_latest(self):
+        return self.__index[-1][1] if self.__index else None
+
+    def get_release(self):
+        """
+        :return: the newest version whose stage is release, or None
+        """
+        for key, vstr in reversed(list(self.__index)):
+            if self.versions[vstr].stage() == PluginStage.release:
+                return vstr
+        return None
+
+    def get_metadata(self, groupid):
+        """
+        Renders the maven-metadata.xml of the plugin, once per group until a version is added
+        :return: a (content, md5, sha1) tuple, content being bytes
+        """
+        metadata = self.__metadata.get(groupid)
+        if metadata:
+            return metadata
+
+        tags = ''
+        if self.get_latest():
+            tags += '        <latest>%s</latest>\n' % escape(self.get_latest())
+        if self.get_release():
+            tags += '        <release>%s</release>\n' % escape(self.get_release())
+
+        timestamps = [t for t in [v.get_timestamp() for v in list(self.versions.values())] if t]
+        updated = '        <lastUpdated>%s</lastUpdated>\n' % time.strftime('%Y%m%d%H%M%S', time.gmtime(max(timestamps))) \
+            if timestamps else ''
+
+        content = Template(Plugin.__METADATA_BASE).substitute(
+            groupid=escape(groupid),
+            artifactid=escape(self.name),
+            tags=tags,
+            versions=''.join('            <version>%s</version>\n' % escape(v) for v in self.get_sorted_versions()),
+            updated=updated
+        ).encode('utf-8')
+
+        metadata = content, hashlib.md5(content).hexdigest(), hashlib.sha1(content).hexdigest()
+        self.__metadata[groupid] = metadata
+        return metadata
 
     def get_version(self, version):
         try:
@@ -75,46 +185,45 @@ class Plugin(object):
     def has_version(self, version):
         return version in self.versions
 
-    def _get_config(self, directory):
-        from os.path import join
-        return join(directory, self.path_name + '.data')
-
-    def load(self, directory):
+    def load(self, storage):
         """
         Loads all available plugin metadata from cache
-        :param directory: the cache root directory
+        :param storage: the MetadataStorage, or the cache root directory
         :return: the plugin itself
         """
-        config = ConfigParser()
-        config.read(self._get_config(directory))
+        with STORAGE_SECONDS.time('load'):
+            config = get_storage(storage).read(self.path_name)
 
-        load(config, self, 'plugin')
-        for section in [s for s in config.sections() if s != 'plugin']:
-            version = PluginVersion(self, section)
-            load(config, version, section)
-            self.versions[section] = version
+            load(config, self, 'plugin')
+            for section in [s for s in config.sections() if s != 'plugin']:
+                version = PluginVersion(self, section)
+                load(config, version, section)
+                self.add_version(version)
 
         return self
 
-    def save(self, directory):
+    def save(self, storage):
         """
         Saves all available plugin metadata to cache
-        :param directory: the cache root directory
+        :param storage: the MetadataStorage, or the cache root directory
         :return: the plugin itself
         """
-        config = ConfigParser()
+        with STORAGE_SECONDS.time('save'):
+            config = ConfigParser()
 
-        save(config, self, 'plugin')
-        for vstr, version in self.versions.items():
-            save(config, version, vstr)
+            save(config, self, 'plugin')
+            for vstr, version in list(self.versions.items()):
+                save(config, version, vstr)
 
-        with open(self._get_config(directory), 'w') as fd:
-            config.write(fd)
+            get_storage(storage).write(self.path_name, config)
 
         return self
 
 
 class PluginVersion(object):
+    __slots__ = ('__plugin', '__version') + \
+        tuple(config_attribute(node) for node in ['url', 'sha1', 'md5', 'date', 'stage', 'game-versions'])
+
     __POM_BASE = \
         '<?xml version="1.0" encoding="UTF-8"?>\n' \
         '<project xsi:schemaLocation="http://maven.apache.org/POM/4.0.0 http://maven.apache.org/xsd/maven-4.0.0.xsd"\n' \
@@ -126,6 +235,10 @@ class PluginVersion(object):
         '    <version>${version}</version>\n' \
         '</project>'
 
+    # BukkitDev shows upload dates as 'Mar 03, 2014 at 03:00 UTC'
+    __DATE_FORMATS = ['%b %d, %Y at %H:%M UTC', '%B %d, %Y at %H:%M UTC',
+                      '%b %d, %Y', '%B %d, %Y', '%Y-%m-%d', '%d %b %Y']
+
     def __init__(self, plugin: Plugin, version):
         if not version or not plugin:
             raise ValueError('plugin or version cannot be None')
@@ -165,19 +278,39 @@ class PluginVersion(object):
     def get_plugin(self):
         return self.__plugin
 
-    def get_pom(self, groupid):
-        return Template(PluginVersion.__POM_BASE).substitute(
+    def get_timestamp(self):
+        """
+        :return: the upload date as a POSIX timestamp, or None if unknown
+        """
+        for fmt in PluginVersion.__DATE_FORMATS:
+            try:
+                return calendar.timegm(time.strptime(self.date() or '', fmt))
+            except ValueError:
+                continue
+        return None
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def render_pom(groupid, artifactid, version):
+        """
+        Renders a POM, once per set of coordinates
+        :return: a (content, md5, sha1) tuple, content being bytes
+        """
+        content = Template(PluginVersion.__POM_BASE).substitute(
             groupid=groupid,
-            artifactid=self.__plugin.name,
-            version=self.__version
-        )
+            artifactid=artifactid,
+            version=version
+        ).encode('utf-8')
+        return content, hashlib.md5(content).hexdigest(), hashlib.sha1(content).hexdigest()
 
-    def __get_pom_hash(self, groupid, hash):
-        hash.update(self.get_pom(groupid).encode('ascii'))
-        return hash.hexdigest()
+    def get_pom_bytes(self, groupid):
+        return self.render_pom(groupid, self.__plugin.name, self.__version)[0]
+
+    def get_pom(self, groupid):
+        return self.get_pom_bytes(groupid).decode('utf-8')
 
     def get_pom_md5(self, groupid):
-        return self.__get_pom_hash(groupid, hashlib.md5())
+        return self.render_pom(groupid, self.__plugin.name, self.__version)[1]
 
     def get_pom_sha1(self, groupid):
-        return self.__get_pom_hash(groupid, hashlib.sha1())
\ No newline at end of file
+        return self.render_pom(groupid, self.__plugin.name, self.__version)[2]
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from blackdog.exception import NoSuchPluginException, NoSuchPluginVersionException, ArtifactUnavailableException
+
+
+Coordinate = namedtuple('Coordinate', ['name', 'version'])
+
+
+def read_coordinates(path, groupid=None):
+    """
+    Reads the plugins to prefetch from a dependency list, which is either
+    a pom.xml, a Gradle lockfile (group:artifact:version=configurations),
+    or a plain list of name[:version] lines.
+    :param path: the dependency list
+    :param groupid: if set, only keep the pom and lockfile dependencies of this group
+    :return: the Coordinates, in file order and without duplicates
+    """
+    if path.endswith('.xml'):
+        coordinates = _read_pom(path, groupid)
+    else:
+        coordinates = _read_list(path, groupid)
+
+    seen = set()
+    return [c for c in coordinates if not (c in seen or seen.add(c))]
+
+
+def _read_pom(path, groupid=None):
+    root = ElementTree.parse(path).getroot()
+    ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+
+    for dependency in root.iter(ns + 'dependency'):
+        group = dependency.findtext(ns + 'groupId')
+        artifact = dependency.findtext(ns + 'artifactId')
+        version = dependency.findtext(ns + 'version')
+        if not artifact or (groupid and group != groupid):
+            continue
+        if version and version.startswith('${'):
+            # property references are left for the build to resolve, fall back to the latest version
+            version = None
+        yield Coordinate(artifact.strip(), version and version.strip())
+
+
+def _read_list(path, groupid=None):
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line or line == 'empty=':
+                continue
+
+            parts = line.split('=', 1)[0].split(':')
+            if len(parts) >= 3:
+                # Gradle lockfile entry: group:artifact:version=configurations
+                if groupid and parts[0] != groupid:
+                    continue
+                parts = parts[1:3]
+            yield Coordinate(parts[0], parts[1] if len(parts) > 1 and parts[1] else None)
+
+
+class Prefetcher(object):
+    """
+    Resolves the metadata of a list of plugins and downloads their jars into
+    the artifact store, so that the first build only hits warm caches.
+    """
+
+    def __init__(self, blackdog, jobs=4):
+        self.blackdog = blackdog
+        self.jobs = jobs
+        self.logger = logging.getLogger('Prefetch')
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = []
+        self.downloaded = 0
+
+    def prefetch_one(self, coordinate: Coordinate):
+        """
+        Resolves a plugin version and stores its jar
+        :param coordinate: the plugin, and the version to fetch, or None for the latest one
+        :return: the prefetched PluginVersion
+        """
+        bukkitdev = self.blackdog.bukkitdev
+        plugin = bukkitdev.get_plugin(coordinate.name, coordinate.version or 'latest')
+        if not plugin.exists():
+            raise NoSuchPluginException(plugin)
+
+        name = coordinate.version or plugin.get_latest()
+        if name is None:
+            raise NoSuchPluginVersionException('latest')
+
+        version = plugin.get_version(name)
+        if not version.can_download():
+            raise ArtifactUnavailableException(version)
+
+        had_sha1 = version.sha1()
+        path = self.blackdog.store.fetch(version)
+        if not path:
+            raise ArtifactUnavailableException(version)
+
+        if not had_sha1 and version.sha1():
+            bukkitdev.mark_dirty(plugin)
+
+        with self.lock:
+            self.downloaded += os.path.getsize(path)
+        return version
+
+    def prefetch(self, coordinates):
+        """
+        Prefetches all the given plugins concurrently, logging the progress
+        :param coordinates: the Coordinates to prefetch
+        :return: the list of Coordinates that could not be prefetched
+        """
+        total = len(coordinates)
+        start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = dict((executor.submit(self.prefetch_one, c), c) for c in coordinates)
+            for future in as_completed(futures):
+                coordinate = futures[future]
+                self.done += 1
+                try:
+                    version = future.result()
+                    self.logger.info('[%s/%s] %s:%s', self.done, total, coordinate.name, version.get_version())
+                except Exception as e:
+                    self.failed.append(coordinate)
+                    self.logger.error('[%s/%s] %s:%s failed: %s', self.done, total,
+                                      coordinate.name, coordinate.version or 'latest',
+                                      getattr(e, 'message', None) or e)
+
+        self.logger.info('Prefetched %s of %s plugins (%.1f MiB) in %.1fs',
+                         total - len(self.failed), total, self.downloaded / (1024 * 1024),
+                         time.monotonic() - start)
+        return self.failed
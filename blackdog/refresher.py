@@ -0,0 +1,75 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import queue
+import threading
+import time
+
+from blackdog.cache import LRUCache
+
+
+class Refresher(object):
+    """
+    Background thread refreshing cached plugin metadata, so that requests
+    can be answered from the cache without waiting for BukkitDev.
+    A plugin lookup is refreshed at most once per interval, and refreshes
+    wait for upstream to be available again.
+    """
+
+    def __init__(self, bukkitdev, interval=300):
+        self.bukkitdev = bukkitdev
+        self.queue = queue.Queue()
+        self.recent = LRUCache(max_size=4096, ttl=interval)
+        self.logger = logging.getLogger('Refresher')
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def schedule(self, name, version=None):
+        """
+        Queues the refresh of a plugin lookup
+        :param name: the plugin name
+        :param version: the looked up version, None for the version list
+        :return: whether the refresh was queued, False if it was already done recently
+        """
+        key = (name, version)
+        with self._lock:
+            if self.recent.get(key):
+                return False
+            self.recent.put(key, True)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='Refresher', daemon=True)
+                self.thread.start()
+
+        self.queue.put(key)
+        return True
+
+    def _run(self):
+        upstream = self.bukkitdev.upstream
+        while True:
+            name, version = self.queue.get()
+            while not upstream.offline and not upstream.is_available():
+                time.sleep(1)
+            if upstream.offline:
+                continue
+
+            try:
+                self.bukkitdev.refresh_plugin(name, version)
+            except Exception as e:
+                self.logger.error('Could not refresh plugin %s %s: %s', name, version or '', e)
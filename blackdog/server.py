@@ -16,28 +16,43 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import hashlib
+import email.utils
+import json
+import os
 import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from http.server import SimpleHTTPRequestHandler
 from socketserver import TCPServer
+from urllib.parse import parse_qs
 import atexit
 
-import requests
-
-from blackdog import PluginVersion, BlackDogException
+from blackdog import Plugin, PluginStage, PluginVersion, BlackDogException
+from blackdog import metrics
 
 
 class HTTPServer(TCPServer):
+    allow_reuse_address = True
 
-    def __init__(self, port):
+    def __init__(self, port, backlog=5, sock=None):
+        """
+        :param sock: a socket already bound and listening, e.g. shared by worker processes
+        """
         super().__init__(("", port), RequestHandler, bind_and_activate=False)
         from blackdog import BlackDog
         self.blackdog = BlackDog.instance
         self.port = port
+        self.request_queue_size = backlog
+        self.bound = sock is not None
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
 
     def __enter__(self):
-        self.server_bind()
-        self.server_activate()
+        if not self.bound:
+            self.server_bind()
+            self.server_activate()
         atexit.register(self.close)
         return self
 
@@ -49,120 +64,423 @@ class HTTPServer(TCPServer):
         self.server_close()
 
 
-def pattern(pattern):
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    Serves requests concurrently from a fixed pool of worker threads,
+    so that a slow upstream lookup does not stall cached responses.
+    """
+
+    def __init__(self, port, threads=8, backlog=64, sock=None):
+        super().__init__(port, backlog, sock)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def close(self):
+        super().close()
+        self.executor.shutdown(wait=False)
+
+
+def pattern(pattern, priority=0):
+    """
+    Routes the requests whose file name matches a pattern to the decorated method.
+    Patterns are tried by decreasing priority.
+    """
     def decorator(func):
-        func.pattern = pattern
+        func.pattern = re.compile(pattern)
+        func.priority = priority
         return func
     return decorator
 
 
+def routes(cls):
+    """
+    Builds the dispatch table of a request handler class
+    :return: a list of (compiled pattern, function) tuples, by decreasing priority
+    """
+    funcs = [getattr(cls, name) for name in dir(cls)]
+    funcs = sorted([f for f in funcs if hasattr(f, 'pattern')], key=lambda f: (-f.priority, f.__name__))
+    return [(f.pattern, f) for f in funcs]
+
+
+MavenPath = namedtuple('MavenPath', ['groupid', 'artifactid', 'version', 'filename'])
+
+
+def parse_maven_path(path):
+    """
+    Splits a repository path: /<group>/<artifact>/<version>/<file>,
+    or /<group>/<artifact>/<file> for the artifact metadata, whose version is None
+    :param path: the request path
+    :return: the MavenPath, or None if the path is not an artifact path
+    """
+    parts = path.split('?', 1)[0].split('/')
+    if len(parts) >= 3 and parts[-1].startswith('maven-metadata.xml'):
+        return MavenPath('.'.join(parts[1:-2]), parts[-2], None, parts[-1])
+    if len(parts) < 4:
+        return None
+    return MavenPath('.'.join(parts[1:-3]), parts[-3], parts[-2], parts[-1])
+
+
 class RequestHandler(SimpleHTTPRequestHandler):
 
-    def get_groupid(self):
-        return '.'.join(self.path.split('/')[1:-3])
+    routes = []
+    maven_path = None
+    request_type = None
+    response_started = False
+    stream_downloads = True
 
-    def handle_pattern(self, path, *args, **kwargs):
-        handles = []
-        for m in [m for m in [getattr(self, m) for m in dir(self)] if hasattr(m, 'pattern')]:
-            handles.append((m.pattern, m))
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.routes = routes(cls)
 
-        for p, m in handles:
-            if re.match(p, path):
-                m(*args, **kwargs)
+    def get_groupid(self):
+        return self.maven_path.groupid
+
+    def handle_pattern(self, filename, *args, **kwargs):
+        for p, func in self.routes:
+            if p.match(filename):
+                self.request_type = func.__name__[len('handle_'):]
+                with metrics.REQUEST_SECONDS.time(self.request_type):
+                    func(self, *args, **kwargs)
                 return True
         return False
 
-    def handle_text(self, content, mime='text/plain'):
-        if not content:
-            self.send_response(404)
+    def handle_endpoint(self):
+        """
+        Answers the requests for the server's own endpoints, outside of the repository
+        :return: whether the request was answered
+        """
+        path, _, query = self.path.partition('?')
+        if path == '/metrics':
+            self.request_type = 'metrics'
+            self.handle_text(metrics.REGISTRY.render(), mime='text/plain; version=0.0.4')
+            return True
+        if path == '/search':
+            self.request_type = 'search'
+            self.handle_search(parse_qs(query))
+            return True
+        return False
+
+    def handle_search(self, params):
+        """
+        Searches the local index, e.g. /search?q=world+edit&stage=release&game-version=1.7.2&limit=20
+        While a missing index is being built in the background, nothing is found.
+        :param params: the parsed query string
+        """
+        param = lambda key: params[key][0] if key in params else None
+
+        stage = PluginStage.from_string(param('stage'))
+        limit = param('limit')
+        if (param('stage') and not stage) or (limit and not limit.isdigit()):
+            self.send_error(400, 'Invalid stage or limit')
+            return
+
+        results = self.server.blackdog.index.search(param('q'), stage=stage, game_version=param('game-version'),
+                                                    limit=int(limit) if limit else None, wait=False)
+        self.handle_text(json.dumps([e._asdict() for e in results]), mime='application/json')
+
+    def send_response(self, code, message=None):
+        metrics.RESPONSES.inc(self.request_type or 'other', code)
+        self.response_started = True
+        super().send_response(code, message)
+
+    def send_failure(self):
+        """
+        Answers 404 to a failed request, or drops the connection if its response was
+        already started, so that the client sees a truncated body instead of a corrupted one
+        """
+        if self.response_started:
+            self.close_connection = True
+        else:
+            self.send_not_found()
+
+    def send_not_found(self):
+        self.send_response(404)
+        self.send_header('Content-length', 0)
+        self.end_headers()
+
+    def send_validators(self, etag, last_modified):
+        if etag:
+            self.send_header('ETag', '"%s"' % etag)
+        if last_modified:
+            self.send_header('Last-Modified', self.date_time_string(last_modified))
+
+    def check_not_modified(self, etag, last_modified):
+        """
+        Answers 304 Not Modified if the client copy is still valid
+        :param etag: the entity tag of the resource, if any
+        :param last_modified: the modification time of the resource as a POSIX timestamp, if any
+        :return: whether the response was sent
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if_modified_since = self.headers.get('If-Modified-Since')
+
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            tags = [(t[2:] if t.startswith('W/') else t).strip('"') for t in tags]
+            not_modified = '*' in tags or (etag and etag in tags)
+        elif if_modified_since and last_modified:
+            try:
+                not_modified = int(last_modified) <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+        else:
+            not_modified = False
+
+        if not_modified:
+            self.send_response(304)
+            self.send_validators(etag, last_modified)
+            self.end_headers()
+        return not_modified
+
+    def get_range(self, size, etag, last_modified):
+        """
+        Parses the Range header of the request, only single byte ranges are supported
+        :param size: the size of the resource
+        :return: the (first, last) byte positions, None to send the whole resource,
+                 or False if the range cannot be satisfied
+        """
+        header = self.headers.get('Range')
+        if not header or not header.startswith('bytes=') or ',' in header:
+            return None
+
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range.strip('"') != etag \
+                and not (last_modified and if_range == self.date_time_string(last_modified)):
+            return None
+
+        first, _, last = header[len('bytes='):].strip().partition('-')
+        try:
+            if not first:
+                if not int(last):
+                    return False
+                first, last = max(size - int(last), 0), size - 1
+            else:
+                first, last = int(first), min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+
+        if first > last:
+            return False
+        return first, last
+
+    def send_file(self, path, mime, etag=None, last_modified=None):
+        """
+        Sends a file from local storage, honoring conditional and range requests
+        """
+        if self.check_not_modified(etag, last_modified):
+            return
+
+        size = os.path.getsize(path)
+        byte_range = self.get_range(size, etag, last_modified)
+
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%s' % size)
+            self.send_header('Content-length', 0)
             self.end_headers()
             return
 
+        if byte_range:
+            first, last = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (first, last, size))
+        else:
+            first, last = 0, size - 1
+            self.send_response(200)
+
+        self.send_header('Content-type', mime)
+        self.send_header('Content-length', last - first + 1)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_validators(etag, last_modified)
+        self.end_headers()
+
+        if self.command != 'HEAD':
+            self.copy_file(path, first, last - first + 1)
+
+    def copy_file(self, path, offset, length):
+        """
+        Copies part of a file to the client, with sendfile(2) where available.
+        socket.sendfile falls back to buffered copying on its own.
+        """
+        metrics.BYTES.inc('out', amount=length)
+        with open(path, 'rb') as f:
+            self.wfile.flush()
+            self.connection.sendfile(f, offset, length)
+
+    def handle_text(self, content, mime='text/plain', etag=None, last_modified=None):
+        """
+        Sends a small in-memory body
+        :param content: the body, as str or bytes
+        :param etag: the entity tag of the body, if any
+        :param last_modified: the modification time of the body as a POSIX timestamp, if any
+        """
+        if not content:
+            self.send_not_found()
+            return
+
+        if self.check_not_modified(etag, last_modified):
+            return
+
+        if isinstance(content, str):
+            content = content.encode('ascii')
+
         self.send_response(200)
         self.send_header('Content-type', mime)
         self.send_header('Content-length', len(content))
+        self.send_validators(etag, last_modified)
         self.end_headers()
-        self.wfile.write(content.encode('ascii'))
+        if self.command != 'HEAD':
+            self.wfile.write(content)
 
     @pattern(r'.*\.jar$')
     def handle_jar(self, version: PluginVersion):
-        if not version.url():
-            self.send_response(404)
-            self.end_headers()
+        if not version.can_download():
+            self.send_not_found()
+            return
+
+        if self.check_not_modified(version.md5(), version.get_timestamp()):
             return
 
-        r = requests.get(version.url(), stream=True)
-        if r.status_code != 200:
-            self.send_response(404)
+        store = self.server.blackdog.store
+        had_sha1 = version.sha1()
+        streamed = []
+
+        def on_start(length):
+            self.send_response(200)
+            self.send_header('Content-type', 'application/java-archive')
+            if length is not None:
+                self.send_header('Content-length', length)
+            else:
+                self.close_connection = True
+            self.send_validators(version.md5(), version.get_timestamp())
             self.end_headers()
-            r.close()
+            streamed.append(length)
+
+        def on_chunk(chunk):
+            self.wfile.write(chunk)
+            metrics.BYTES.inc('out', amount=len(chunk))
+
+        if self.stream_downloads and self.command == 'GET' and 'Range' not in self.headers \
+                and not store.get(version.md5()):
+            try:
+                path = store.fetch(version, on_start, on_chunk)
+            except Exception as e:
+                if not streamed:
+                    raise
+                self.server.blackdog.logger.error('Download of %s failed while streaming it: %s', version.url(), e)
+                self.close_connection = True
+                return
+        else:
+            path = store.fetch(version)
+
+        if not had_sha1 and version.sha1():
+            self.server.blackdog.bukkitdev.mark_dirty(version.get_plugin())
+
+        if streamed:
+            if not path:
+                # the client already received the corrupted body, drop the connection
+                self.close_connection = True
             return
 
-        self.send_response(200)
-        self.send_header('Content-type', 'application/java-archive')
-        self.send_header('Content-length', r.headers['content-length'])
-        self.end_headers()
+        if not path:
+            self.send_not_found()
+            return
 
-        if not version.sha1():
-            sha1 = hashlib.sha1()
-            for chunk in r.iter_content(16 * 1024):
-                self.wfile.write(chunk)
-                sha1.update(chunk)
-            version.sha1(sha1.hexdigest())
-            self.server.blackdog.bukkitdev.save_plugin(version.get_plugin())
-        else:
-            for chunk in r.iter_content(16 * 1024):
-                self.wfile.write(chunk)
+        self.send_file(path, 'application/java-archive', version.md5(), version.get_timestamp())
 
     @pattern(r'.*\.pom$')
     def handle_pom(self, version: PluginVersion):
-        self.handle_text(version.get_pom(self.get_groupid()), mime='text/xml')
+        groupid = self.get_groupid()
+        self.handle_text(version.get_pom_bytes(groupid), mime='text/xml',
+                         etag=version.get_pom_sha1(groupid), last_modified=version.get_timestamp())
 
-    @pattern(r'.*\.jar.sha1$')
+    @pattern(r'.*\.jar\.sha1$', priority=1)
     def handle_jar_sha1(self, version: PluginVersion):
-        self.handle_text(version.sha1())
+        if self.server.blackdog.store.fill_sha1(version):
+            self.server.blackdog.bukkitdev.mark_dirty(version.get_plugin())
+        sha1 = version.sha1()
+        self.handle_text(sha1, etag=sha1 and sha1 + '.sha1', last_modified=version.get_timestamp())
 
-    @pattern(r'.*\.jar.md5$')
+    @pattern(r'.*\.jar\.md5$', priority=1)
     def handle_jar_md5(self, version: PluginVersion):
-        self.handle_text(version.md5())
+        md5 = version.md5()
+        self.handle_text(md5, etag=md5 and md5 + '.md5', last_modified=version.get_timestamp())
 
-    @pattern(r'.*\.pom.sha1$')
+    @pattern(r'.*\.pom\.sha1$', priority=1)
     def handle_pom_sha1(self, version: PluginVersion):
-        self.handle_text(version.get_pom_sha1(self.get_groupid()))
+        sha1 = version.get_pom_sha1(self.get_groupid())
+        self.handle_text(sha1, etag=sha1 + '.sha1', last_modified=version.get_timestamp())
 
-    @pattern(r'.*\.pom.md5$')
+    @pattern(r'.*\.pom\.md5$', priority=1)
     def handle_pom_md5(self, version: PluginVersion):
-        self.handle_text(version.get_pom_md5(self.get_groupid()))
+        md5 = version.get_pom_md5(self.get_groupid())
+        self.handle_text(md5, etag=md5 + '.md5', last_modified=version.get_timestamp())
+
+    @pattern(r'maven-metadata\.xml$')
+    def handle_metadata(self, plugin: Plugin):
+        content, md5, sha1 = plugin.get_metadata(self.get_groupid())
+        self.handle_text(content, mime='text/xml', etag=sha1)
+
+    @pattern(r'maven-metadata\.xml\.sha1$', priority=1)
+    def handle_metadata_sha1(self, plugin: Plugin):
+        content, md5, sha1 = plugin.get_metadata(self.get_groupid())
+        self.handle_text(sha1, etag=sha1 + '.sha1')
+
+    @pattern(r'maven-metadata\.xml\.md5$', priority=1)
+    def handle_metadata_md5(self, plugin: Plugin):
+        content, md5, sha1 = plugin.get_metadata(self.get_groupid())
+        self.handle_text(md5, etag=md5 + '.md5')
+
+    def do_HEAD(self):
+        self.do_GET()
 
     def do_GET(self):
         from blackdog import BlackDog
         blackdog = BlackDog.instance
 
-        try:
-            dir_path = self.path.split('/')[:-1]
-            plugin_version = dir_path[-1]
-            plugin_name = dir_path[-2]
-        except:
-            self.send_response(404)
-            self.end_headers()
+        self.request_type = None
+        self.response_started = False
+        if self.handle_endpoint():
+            return
+
+        self.maven_path = parse_maven_path(self.path)
+        if not self.maven_path:
+            self.send_not_found()
             return
+        plugin_name, plugin_version = self.maven_path.artifactid, self.maven_path.version
 
         try:
+            if plugin_version is None:
+                plugin = blackdog.bukkitdev.get_version_list(plugin_name)
+                if not plugin.versions or not self.handle_pattern(self.maven_path.filename, plugin):
+                    self.send_not_found()
+                return
+
             plugin = blackdog.bukkitdev.get_plugin(plugin_name, no_query=True)
             if not plugin.has_version(plugin_version) or not plugin.get_version(plugin_version).can_download():
                 plugin = blackdog.bukkitdev.get_plugin(plugin_name, version=plugin_version)
 
             version = plugin.get_version(plugin_version)
 
-            if not self.handle_pattern(self.path, version):
-                self.send_response(404)
-                self.end_headers()
+            if not self.handle_pattern(self.maven_path.filename, version):
+                self.send_not_found()
 
         except BlackDogException as e:
             blackdog.logger.error(e.message)
-            self.send_response(404)
-            self.end_headers()
+            self.send_failure()
         except Exception as e:
             blackdog.logger.exception(e)
-            self.send_response(404)
-            self.end_headers()
\ No newline at end of file
+            self.send_failure()
+
+
+RequestHandler.routes = routes(RequestHandler)
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sqlite3
+import stat
+import threading
+import time
+from configparser import ConfigParser
+from os.path import join
+
+from blackdog.sync import FileLock
+
+
+class MetadataStorage(object):
+    """
+    Backend holding the cached plugin metadata.
+    Plugins are stored as ConfigParser documents, keyed by their path name,
+    with a 'plugin' section and one section per version.
+    """
+
+    def read(self, name):
+        """
+        Reads the metadata of a plugin
+        :param name: the plugin path name
+        :return: a ConfigParser, empty if the plugin is unknown
+        """
+        raise NotImplementedError
+
+    def write(self, name, config: ConfigParser):
+        """
+        Replaces the metadata of a plugin
+        :param name: the plugin path name
+        :param config: the plugin metadata
+        """
+        raise NotImplementedError
+
+    def names(self):
+        """
+        :return: the path names of all the stored plugins
+        """
+        raise NotImplementedError
+
+
+class FileStorage(MetadataStorage):
+    """
+    Stores each plugin in its own <name>.data file.
+    Files are replaced atomically: they are written to a temporary file which
+    is synced then renamed over the previous one, so that a crash never leaves
+    a truncated file behind. Writers of a plugin are serialized, across
+    processes as well, by a lock file in .locks.
+    """
+
+    # directories cleaned by this process
+    cleaned = set()
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.locks = join(directory, '.locks')
+        os.makedirs(self.locks, mode=0o755, exist_ok=True)
+        if directory not in FileStorage.cleaned:
+            FileStorage.cleaned.add(directory)
+            self._clean()
+
+    def _clean(self, max_age=3600):
+        # temporary files left by a crash, old enough not to belong to a running writer
+        for f in [f for f in os.listdir(self.directory) if f.startswith('.') and f.endswith('.data.tmp')]:
+            path = join(self.directory, f)
+            try:
+                if os.path.getmtime(path) < time.time() - max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def path(self, name):
+        return join(self.directory, name + '.data')
+
+    def lock(self, name):
+        return FileLock(join(self.locks, name + '.lock'))
+
+    def read(self, name):
+        config = ConfigParser()
+        config.read(self.path(name))
+        return config
+
+    def write(self, name, config: ConfigParser):
+        with self.lock(name):
+            # created like open() does, the umask applying to new files
+            tmp = join(self.directory, '.%s.%s.data.tmp' % (name, os.urandom(6).hex()))
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    try:
+                        os.fchmod(fd, stat.S_IMODE(os.stat(self.path(name)).st_mode))
+                    except FileNotFoundError:
+                        pass
+                    config.write(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path(name))
+            except BaseException:
+                os.remove(tmp)
+                raise
+            self._sync_directory()
+
+    def _sync_directory(self):
+        # makes the rename itself durable
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def names(self):
+        return [f[:-len('.data')] for f in os.listdir(self.directory) if f.endswith('.data')]
+
+
+class SQLiteStorage(MetadataStorage):
+    """
+    Stores all plugins in a single sqlite database, indexed by plugin and version
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # connections must not be shared with forked worker processes
+        os.register_at_fork(after_in_child=self._reset)
+
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                       'plugin TEXT NOT NULL, section TEXT NOT NULL, key TEXT NOT NULL, value TEXT, '
+                       'PRIMARY KEY (plugin, section, key))')
+
+    def _reset(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def read(self, name):
+        config = ConfigParser()
+        rows = self._connection().execute('SELECT section, key, value FROM metadata WHERE plugin = ?', (name,))
+        for section, key, value in rows:
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, key, value)
+        return config
+
+    def write(self, name, config: ConfigParser):
+        with self._connection() as db:
+            db.execute('DELETE FROM metadata WHERE plugin = ?', (name,))
+            db.executemany('INSERT INTO metadata (plugin, section, key, value) VALUES (?, ?, ?, ?)',
+                           [(name, section, key, value)
+                            for section in config.sections()
+                            for key, value in config.items(section, raw=True)])
+
+    def names(self):
+        return [row[0] for row in self._connection().execute('SELECT DISTINCT plugin FROM metadata')]
+
+
+def get_storage(storage):
+    """
+    :param storage: a MetadataStorage, or a cache directory holding .data files
+    :return: the matching MetadataStorage
+    """
+    return storage if isinstance(storage, MetadataStorage) else FileStorage(storage)
+
+
+def migrate(source: MetadataStorage, destination: MetadataStorage):
+    """
+    Copies all plugin metadata from a storage to another
+    :return: the number of migrated plugins
+    """
+    names = source.names()
+    for name in names:
+        destination.write(name, source.read(name))
+    return len(names)
@@ -0,0 +1,269 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from os.path import exists, join
+
+from blackdog.metrics import BYTES, CACHE, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+from blackdog.sync import FileLock, SingleFlight
+from blackdog.upstream import Upstream
+
+
+class ArtifactStore(object):
+    """
+    Content-addressed jar store, keyed by the md5 scraped from BukkitDev.
+    Least recently used artifacts are evicted once max_size is exceeded.
+    The last limit set is kept in the directory, so that every process
+    sharing the store, like a prefetch next to the server, enforces it.
+    """
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024, upstream=None):
+        self.directory = directory
+        self.upstream = upstream or Upstream()
+        self.max_size = self._read_max_size() or max_size
+        self.logger = logging.getLogger('ArtifactStore')
+        self.entries = OrderedDict()
+        self.size = 0
+        self.index_interval = 60
+        self.indexed_at = 0
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+
+        os.makedirs(directory, mode=0o755, exist_ok=True)
+        self._scan()
+
+    def _path(self, digest):
+        return join(self.directory, digest[:2], digest + '.jar')
+
+    def _scan(self, max_age=3600):
+        for root, dirs, files in os.walk(self.directory):
+            # downloads left by a crash, old enough not to belong to a running process
+            for name in [f for f in files if f.endswith('.part')]:
+                try:
+                    if os.path.getmtime(join(root, name)) < time.time() - max_age:
+                        os.remove(join(root, name))
+                except OSError:
+                    pass
+        self._index()
+
+    def _index(self):
+        """
+        Lists the stored jars from the directory, least recently used first
+        """
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in [f for f in files if f.endswith('.jar')]:
+                try:
+                    st = os.stat(join(root, name))
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, name[:-len('.jar')], st.st_size))
+
+        self.entries.clear()
+        self.size = 0
+        for mtime, digest, size in sorted(found):
+            self.entries[digest] = size
+            self.size += size
+        self.indexed_at = time.monotonic()
+
+    def _evict(self):
+        # worker processes share the directory: the jars they stored only show in a listing
+        # of it, done once the size counted here exceeds the limit, or every index_interval
+        if self.size <= self.max_size and time.monotonic() - self.indexed_at < self.index_interval:
+            return
+
+        # the modification times tell which jars were used last, by any process
+        with FileLock(join(self.directory, '.lock')):
+            self._index()
+            while self.size > self.max_size and len(self.entries) > 1:
+                digest, size = self.entries.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(self._path(digest))
+                except FileNotFoundError:
+                    pass
+                self.logger.info('Evicted artifact %s (%s bytes)', digest, size)
+
+    def _read_max_size(self):
+        try:
+            with open(join(self.directory, '.max_size')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def set_max_size(self, max_size):
+        """
+        Sets the size limit of the store, for every process sharing it
+        :param max_size: the limit, in bytes
+        """
+        with self.lock:
+            self.max_size = max_size
+            with open(join(self.directory, '.max_size'), 'w') as f:
+                f.write(str(max_size))
+            self._evict()
+
+    def get(self, digest):
+        """
+        Looks up an artifact without touching the network
+        :param digest: the md5 of the artifact
+        :return: the path of the artifact on disk, or None
+        """
+        if not digest:
+            return None
+        digest = digest.lower()
+        path = self._path(digest)
+        with self.lock:
+            if digest not in self.entries:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                # stored by another process sharing the directory
+                self.entries[digest] = size
+                self.size += size
+
+            elif not exists(path):
+                self.size -= self.entries.pop(digest)
+                return None
+
+            self.entries.move_to_end(digest)
+            os.utime(path, None)
+            return path
+
+    def put(self, digest, source):
+        """
+        Moves a verified file into the store
+        :param digest: the md5 of the file
+        :param source: the path of the file, consumed by the store
+        :return: the path of the artifact in the store
+        """
+        digest = digest.lower()
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+
+        with self.lock:
+            os.replace(source, path)
+            size = os.path.getsize(path)
+            self.size += size - self.entries.pop(digest, 0)
+            self.entries[digest] = size
+            self._evict()
+        return path
+
+    def fetch(self, version, on_start=None, on_chunk=None):
+        """
+        Gets the artifact of a version, downloading it on the first request.
+        The download is only committed if it matches the version md5.
+        The version sha1 is filled in if it was missing.
+        Concurrent fetches of the same url share a single download, and only
+        the caller that performs it gets the streaming callbacks.
+        :param version: the plugin version
+        :param on_start: called with the upstream content length, or None, before the first chunk
+        :param on_chunk: called with each downloaded chunk, while it is written to the store
+        :return: the path of the artifact on disk, or None
+        """
+        path = self.get(version.md5())
+        CACHE.inc('artifacts', 'hit' if path else 'miss')
+        if path:
+            self.fill_sha1(version, path)
+            return path
+        if not self.upstream.is_available():
+            return None
+
+        return self.flights.do(version.url(), self._download, version, on_start, on_chunk)
+
+    def fill_sha1(self, version, path=None):
+        """
+        Fills in a missing version sha1 from its stored artifact, without touching the network
+        :param version: the plugin version
+        :param path: the path of the artifact, if already looked up
+        :return: whether the sha1 was filled in
+        """
+        if version.sha1():
+            return False
+        path = path or self.get(version.md5())
+        if not path:
+            return False
+
+        sha1 = hashlib.sha1()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    sha1.update(chunk)
+        except FileNotFoundError:
+            return False
+        version.sha1(sha1.hexdigest())
+        return True
+
+    def _download(self, version, on_start=None, on_chunk=None):
+        path = self.get(version.md5())
+        if path:
+            return path
+
+        with UPSTREAM_SECONDS.time('artifact'):
+            return self._do_download(version, on_start, on_chunk)
+
+    def _do_download(self, version, on_start=None, on_chunk=None):
+        try:
+            r = self.upstream.get(version.url(), stream=True)
+        except Exception:
+            UPSTREAM_ERRORS.inc('artifact')
+            raise
+        if r.status_code != 200:
+            UPSTREAM_ERRORS.inc('artifact')
+            r.close()
+            return None
+
+        md5, sha1 = hashlib.md5(), hashlib.sha1()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            if on_start:
+                # decoded chunks do not add up to the length of an encoded body
+                on_start(None if 'content-encoding' in r.headers else r.headers.get('content-length'))
+
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in r.iter_content(64 * 1024):
+                    f.write(chunk)
+                    BYTES.inc('in', amount=len(chunk))
+                    md5.update(chunk)
+                    sha1.update(chunk)
+
+                    if on_chunk:
+                        try:
+                            on_chunk(chunk)
+                        except OSError:
+                            self.logger.info('Client went away, finishing download of %s', version.url())
+                            on_chunk = None
+
+            if md5.hexdigest() != version.md5().lower():
+                self.logger.error('Checksum mismatch for %s: expected %s, got %s, discarding it',
+                                  version.url(), version.md5(), md5.hexdigest())
+                return None
+
+            if not version.sha1():
+                version.sha1(sha1.hexdigest())
+            return self.put(md5.hexdigest(), tmp)
+        finally:
+            r.close()
+            if exists(tmp):
+                os.remove(tmp)
@@ -0,0 +1,90 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from blackdog.exception import UpstreamUnavailableException
+
+
+class Upstream(object):
+    """
+    HTTP client shared by everything that talks to BukkitDev.
+    Connections are pooled and kept alive, requests time out, and
+    connection errors and 5xx responses are retried with exponential backoff.
+
+    When offline, no request is sent at all. When fail_fast is set, requests
+    fail immediately for that many seconds after upstream failed to answer,
+    instead of waiting for it to time out again.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, retries=3, backoff=0.5, gzip=True):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.offline = False
+        self.fail_fast = 0
+        self._failed_at = None
+        self.session = requests.Session()
+        if not gzip:
+            self.session.headers['Accept-Encoding'] = 'identity'
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+        """
+        Sets the maximum number of connections kept alive per upstream host
+        """
+        self.pool_size = pool_size
+        retry = Retry(total=self.retries,
+                      backoff_factor=self.backoff,
+                      status_forcelist=[500, 502, 503, 504],
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def is_available(self):
+        """
+        :return: whether requests are currently let through
+        """
+        if self.offline:
+            return False
+        failed_at = self._failed_at
+        return not self.fail_fast or failed_at is None or time.monotonic() - failed_at >= self.fail_fast
+
+    def request(self, method, url, **kwargs):
+        if not self.is_available():
+            raise UpstreamUnavailableException(url)
+
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._failed_at = time.monotonic()
+            raise
+        self._failed_at = time.monotonic() if r.status_code >= 500 else None
+        return r
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
@@ -0,0 +1,120 @@
+"""
+BlackDog
+
+Copyright (C) 2014 Snaipe, Therozin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import signal
+import socket
+import time
+
+
+def listen(port, backlog=64):
+    """
+    Binds the listening socket shared by the worker processes
+    :param port: the port number
+    :param backlog: the maximum number of pending connections
+    :return: the socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', port))
+    sock.listen(backlog)
+    return sock
+
+
+class WorkerGroup(object):
+    """
+    Pre-forked serving processes, all accepting connections on a socket bound
+    by the master process. They share the metadata and artifact stores on disk.
+    The master only supervises: it restarts the workers that die, and stops
+    them all when it is asked to terminate.
+    """
+
+    def __init__(self, workers, serve, pidfile=None):
+        """
+        :param workers: the number of worker processes
+        :param serve: the function serving requests in a worker, until the worker is killed
+        :param pidfile: the file listing the pids of the master and the workers
+        """
+        self.workers = workers
+        self.serve = serve
+        self.pidfile = pidfile
+        self.pids = set()
+        self.stopping = False
+        self.logger = logging.getLogger('Workers')
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            status = 0
+            try:
+                self.serve()
+            except SystemExit:
+                pass
+            except BaseException as e:
+                self.logger.exception(e)
+                status = 1
+            finally:
+                os._exit(status)
+
+        self.pids.add(pid)
+        return pid
+
+    def write_pidfile(self):
+        if self.pidfile:
+            with open(self.pidfile, 'w') as f:
+                f.write('\n'.join(str(pid) for pid in [os.getpid()] + sorted(self.pids)))
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """
+        Starts the workers, then supervises them until stopped by SIGTERM or SIGINT
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(self.workers):
+            self.spawn()
+        self.write_pidfile()
+        self.logger.info('Started %s workers', self.workers)
+
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.pids.discard(pid)
+
+            if not self.stopping:
+                self.logger.error('Worker %s exited with status %s, restarting it', pid, status)
+                # do not spin if workers die right away
+                time.sleep(1)
+                if not self.stopping:
+                    self.spawn()
+                    self.write_pidfile()
+
+        self.logger.info('All workers stopped')
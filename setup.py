@@ -34,7 +34,7 @@ setup(
     keywords="minecraft bukkitdev plugin maven repository",
     url="http://github.com/Snaipe/BlackDog.git",
     packages=['blackdog'],
-    install_requires=['pyquery', 'baker', 'requests'],
+    install_requires=['lxml', 'baker', 'requests'],
     long_description=read('README.md'),
     scripts=['bin/blackdog'],
     include_package_data=True,